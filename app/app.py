@@ -8,18 +8,51 @@ import plotly.graph_objs as go
 import plotly.figure_factory as ff
 import numpy as np
 import pandas as pd
-from start import samples, find_closest, healthiest_sample, meta, describe, bact_plot, firm_plot
+from functools import lru_cache
+from urllib.parse import urlencode, quote
+from flask import request
+from start import (
+    ALL,
+    views,
+    samples,
+    healthiest_sample,
+    percentiles,
+    bact_plot,
+    firm_plot,
+    cohort_neighbours,
+    data,
+    ranked_genera,
+    dataset,
+)
+from contrast import contrast
+from export import stream_export
+from metadata import SUBGROUPS
+from jobs import JobQueue, QueueFull
+from neighbours import MAX_NEIGHBOURS, neighbourhood, describe_neighbourhood
+from percentiles import percentile, ratio
 
 
 close = pd.Series(0, index=samples.index)
-meta = meta[meta.sample_name.isin(samples.index)]
+# Job states and results are shared through a directory so any server
+# worker can answer a poll for a search started by another one
+jobs = JobQueue(
+    workers=2, max_pending=8, timeout=120, directory="job_results"
+)
 colors = pd.Series(["#3F51B5", "#E91E63", "#009688"])
 
 
-def beta_figure(close, size=16):
-    """Generate the beta diversity figure."""
+def beta_figure(close, size=16, samples=samples, reference=None):
+    """Generate the beta diversity figure.
+
+    `reference` are the coordinates of the healthy reference in the shown
+    ordination. The marker is hidden if the ordination has no healthy
+    individuals.
+    """
     s = samples[close == 0]
     ns = samples[close == 1]
+    if reference is None:
+        reference = views[ALL]["healthy"]
+    visible = bool(reference.notna().all())
 
     return {
         "data": [
@@ -45,8 +78,8 @@ def beta_figure(close, size=16):
             ),
             go.Scattergl(
                 name="",
-                x=[healthiest_sample.PC1],
-                y=[healthiest_sample.PC2],
+                x=[reference.PC1] if visible else [],
+                y=[reference.PC2] if visible else [],
                 showlegend=False,
                 text=[
                     "Bacteroidetes: %.1f%%<br />Firmicutes: %.1f%%"
@@ -111,7 +144,7 @@ def beta_figure(close, size=16):
     }
 
 
-def info_fields(description):
+def info_fields(description, k):
     """Draw an info field."""
     if description.shape[0] == 0:
         return None
@@ -131,7 +164,7 @@ def info_fields(description):
                     },
                 ),
                 html.Span(
-                    "%d of %d" % (row["values"], sum(close == 1)),
+                    "%d of %d" % (row["values"], k),
                     style={
                         "font": "24px Lato",
                         "vertical-align": "middle",
@@ -147,12 +180,60 @@ def info_fields(description):
     return fields
 
 
-def info_text(description):
+@lru_cache(maxsize=256)
+def neighbour_stats(bac, firm, ordination=ALL):
+    """Get the closest individuals and their cumulative statistics.
+
+    Only depends on the slider positions and the ordination so changing the
+    number of neighbours only needs a lookup.
+    """
+    view = views[ordination]
+    order = view["neighbours"][bac, firm]
+    return order, neighbourhood(order, view["features"])
+
+
+@lru_cache(maxsize=256)
+def neighbour_contrast(bac, firm, k, ordination=ALL):
+    """Find the genera that are distinctive for the closest individuals.
+
+    Compares the k closest individuals against all participants using the
+    precomputed genus ranks.
+    """
+    if "ranks" not in data:
+        return None
+    order, _ = neighbour_stats(bac, firm, ordination)
+    members = views[ordination]["display"][order[:k]]
+    return contrast(data["ranks"], data["ties"], members, ranked_genera)
+
+
+def contrast_fields(result, n=3):
+    """List the most enriched and depleted genera."""
+    if result is None:
+        return None
+    result = result[result.auc.notna()]
+    fields = []
+    for label, rows in [
+        ("More common", result[result.auc > 0.5].head(n)),
+        ("Less common", result[result.auc < 0.5].head(n)),
+    ]:
+        fields.extend(
+            html.P(
+                "%s in your neighbours: %s (%.0f%% chance to have more than "
+                "others, q=%.2g)"
+                % (label, row.genus, row.auc * 100, row.q)
+            )
+            for _, row in rows.iterrows()
+        )
+    return fields
+
+
+def info_text(description, k):
     return (
-        "The 5 persons that are the closest to you in the Bacteroidetes "
+        "The %d persons that are the closest to you in the Bacteroidetes "
         "and Firmicutes percentages are on average %.1f years old, "
         "have a BMI of %.1f and are %.1f cm tall."
         % (
+            k,
             description[description.names == "Average age"]["values"],
             description[description.names == "Average BMI"]["values"],
             description[description.names == "Average height (cm)"]["values"],
@@ -160,6 +241,36 @@ def info_text(description):
     )
 
 
+def cohort_text(description):
+    """Summarize the neighbours found among all participants."""
+    values = {row["names"]: row["values"] for row in description}
+    return (
+        "Among all participants your closest neighbours are on average "
+        "%.1f years old and have a BMI of %.1f. %d of them have a dog and "
+        "%d have a college degree."
+        % (
+            values["Average age"],
+            values["Average BMI"],
+            values["Dogs"],
+            values["College degree"],
+        )
+    )
+
+
+def percentile_text(bac, firm):
+    """Describe where the input falls in the full cohort."""
+    return (
+        "More Bacteroidetes than %.0f%% and more Firmicutes than %.0f%% "
+        "of all participants. Your Bacteroidetes to Firmicutes ratio is "
+        "higher than in %.0f%% of all participants."
+        % (
+            percentile(percentiles, "Bacteroidetes", bac),
+            percentile(percentiles, "Firmicutes", firm),
+            percentile(percentiles, "ratio", ratio(bac, firm)),
+        )
+    )
+
+
 app = dash.Dash(
     __name__,
     external_stylesheets=[
@@ -167,6 +278,66 @@ app = dash.Dash(
         "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.9.0/css/all.min.css",
     ],
 )
+server = app.server
+
+
+def download_links(bac, firm, k, ordination):
+    """Link to the exports of the neighbours and the shown participants."""
+    neighbours = urlencode(
+        {"bac": bac, "firm": firm, "k": k, "ordination": ordination}
+    )
+    if ordination == ALL:
+        label = "all participants"
+    else:
+        label = "all participants in the %s subgroup" % ordination
+    return [
+        html.A(
+            "Download your neighbours",
+            href="/download/neighbours?" + neighbours,
+        ),
+        " or ",
+        html.A(
+            label,
+            href="/download/subgroup/" + quote(ordination),
+        ),
+        " with their metadata and genus counts (CSV, add `format=parquet` "
+        "for Parquet).",
+    ]
+
+
+@server.route("/download/neighbours")
+def download_neighbours():
+    """Stream the closest displayed individuals with their data."""
+    bac = request.args.get("bac", 40, type=int)
+    firm = request.args.get("firm", 20, type=int)
+    k = request.args.get("k", 5, type=int)
+    ordination = request.args.get("ordination", ALL)
+    if ordination not in views or not (0 <= bac <= 100 and 0 <= firm <= 100):
+        return "Unknown ordination or abundances.", 400
+    order, _ = neighbour_stats(bac, firm, ordination)
+    shown = views[ordination]["samples"]
+    ids = shown.index[order[:max(k, 0)]]
+    return stream_export(
+        dataset.samples(ids),
+        "neighbours",
+        request.args.get("format", "csv"),
+    )
+
+
+@server.route("/download/subgroup/<name>")
+def download_subgroup(name):
+    """Stream all individuals of a subgroup with their data."""
+    if name == ALL:
+        query = dataset
+    elif name in SUBGROUPS:
+        query = dataset.where(**SUBGROUPS[name])
+    else:
+        return "Unknown subgroup `%s`." % name, 404
+    return stream_export(
+        query,
+        name.lower().replace(" ", "_"),
+        request.args.get("format", "csv"),
+    )
 
 app.layout = html.Div(
     style={
@@ -196,7 +367,7 @@ app.layout = html.Div(
                     "Redder points represent a higher ratio of Bacteroidetes."
                 ),
                 html.P(
-                    "Pink points show the 5 closest individuals to your distribution."
+                    "Pink points show the closest individuals to your distribution."
                 ),
                 html.P(
                     "The purple point represents the ideal distribution for a healthy individual."
@@ -251,6 +422,18 @@ app.layout = html.Div(
                 "flex-wrap": "wrap",
             },
         ),
+        html.Div(
+            [
+                "compare yourself to",
+                dcc.Dropdown(
+                    id="ordination",
+                    options=[{"label": name, "value": name} for name in views],
+                    value=ALL,
+                    clearable=False,
+                ),
+            ],
+            style={"margin": "0 5vw"},
+        ),
         dcc.Graph(
             id="phyla_graph",
             figure=beta_figure(close),
@@ -272,6 +455,28 @@ app.layout = html.Div(
                 ),
             ],
             style={"margin": "0 5vw", "margin-bottom": "2em"},
+        ),
+        html.Div(
+            [
+                "number of neighbours",
+                dcc.Slider(
+                    id="k_slider",
+                    min=1,
+                    max=MAX_NEIGHBOURS,
+                    step=1,
+                    value=5,
+                    marks={
+                        str(i): str(i)
+                        for i in [1] + list(range(10, MAX_NEIGHBOURS + 1, 10))
+                    },
+                ),
+            ],
+            style={"margin": "0 5vw", "margin-bottom": "2em"},
+        ),
+        html.P(
+            percentile_text(0.4, 0.2),
+            id="percentiles",
+            style={"font": "16px Lato", "color": "#777", "margin": "0 5vw"},
         ),
               dcc.Graph(
             id="firmicutes_plot",
@@ -314,6 +519,28 @@ app.layout = html.Div(
             },
             id="info",
         ),
+        html.Div(
+            None,
+            id="contrast",
+            style={"font": "16px Lato", "color": "#777", "margin": "0 5vw"},
+        ),
+        html.P(
+            download_links(40, 20, 5, ALL),
+            id="downloads",
+            style={"font": "16px Lato", "color": "#777", "margin": "1em 5vw"},
+        ),
+        html.Button(
+            "Compare with all participants",
+            id="cohort_button",
+            style={"margin": "0 5vw"},
+        ),
+        html.P(
+            None,
+            id="cohort_text",
+            style={"font": "16px Lato", "color": "#777", "margin": "1em 5vw"},
+        ),
+        dcc.Store(id="cohort_job"),
+        dcc.Interval(id="cohort_poll", interval=1000, disabled=True),
     ],
 )
 
@@ -345,31 +572,80 @@ def update_bac(firm, bac):
         dash.dependencies.Output("info_text", "children"),
         dash.dependencies.Output("bacteroidetes_plot", "figure"),
         dash.dependencies.Output("firmicutes_plot", "figure"),
-
+        dash.dependencies.Output("percentiles", "children"),
+        dash.dependencies.Output("contrast", "children"),
+        dash.dependencies.Output("downloads", "children"),
     ],
     [
         dash.dependencies.Input("firm_slider", "value"),
         dash.dependencies.Input("bac_slider", "value"),
         dash.dependencies.Input("size_slider", "value"),
-        
+        dash.dependencies.Input("k_slider", "value"),
+        dash.dependencies.Input("ordination", "value"),
     ],
 )
-def update_figure(firm, bac, s):
+def update_figure(firm, bac, s, k, ordination):
     """Update the beta diversity figure."""
-    best = find_closest(bac / 100, firm / 100, samples, n=5)
-    close[:] = 0
-    if best is not None:
-        close[best] = 1
-    description = describe(samples[close == 1], meta)
+    shown = views[ordination]["samples"]
+    order, stats = neighbour_stats(bac, firm, ordination)
+    k = min(k, order.shape[0])
+    close = pd.Series(0, index=shown.index)
+    close.iloc[order[:k]] = 1
+    description = describe_neighbourhood(stats, k)
     return (
-        beta_figure(close, s),
-        info_fields(description),
-        info_text(description),
-        bact_plot(samples, bac/100, healthiest_sample),
-        firm_plot(samples, firm/100, healthiest_sample)
-
+        beta_figure(close, s, shown, views[ordination]["healthy"]),
+        info_fields(description, k),
+        info_text(description, k),
+        bact_plot(shown, bac/100, healthiest_sample),
+        firm_plot(shown, firm/100, healthiest_sample),
+        percentile_text(bac / 100, firm / 100),
+        contrast_fields(neighbour_contrast(bac, firm, k, ordination)),
+        download_links(bac, firm, k, ordination),
     )
 
 
+@app.callback(
+    dash.dependencies.Output("cohort_job", "data"),
+    [dash.dependencies.Input("cohort_button", "n_clicks")],
+    [
+        dash.dependencies.State("firm_slider", "value"),
+        dash.dependencies.State("bac_slider", "value"),
+        dash.dependencies.State("k_slider", "value"),
+    ],
+)
+def submit_cohort(clicks, firm, bac, k):
+    """Start the neighbour search over all participants."""
+    if not clicks:
+        return None
+    try:
+        return jobs.submit(cohort_neighbours, bac / 100, firm / 100, k)
+    except QueueFull:
+        return "busy"
+
+
+@app.callback(
+    [
+        dash.dependencies.Output("cohort_text", "children"),
+        dash.dependencies.Output("cohort_poll", "disabled"),
+    ],
+    [
+        dash.dependencies.Input("cohort_poll", "n_intervals"),
+        dash.dependencies.Input("cohort_job", "data"),
+    ],
+)
+def poll_cohort(_, key):
+    """Check whether the neighbour search has finished."""
+    if key is None:
+        return None, True
+    if key == "busy":
+        return "The server is busy right now, please try again later.", True
+    state, description = jobs.status(key)
+    if state == "pending":
+        return "Searching all participants...", False
+    if state == "done":
+        return cohort_text(description), True
+    return "The search did not finish, please try again.", True
+
+
 if __name__ == "__main__":
     app.run_server(debug=True)
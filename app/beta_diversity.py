@@ -1,68 +1,67 @@
 """Calculate beta diversity and ordination."""
 
 import logging
-import pickle
 from os import path
-import pandas as pd
-from skbio.diversity import beta_diversity
+import numpy as np
+from skbio import DistanceMatrix
 from skbio.stats.ordination import pcoa
-from skbio.stats import subsample_counts
+from dataset import open_dataset
+from ordination import load_distances, subgroup_ordinations
+from tiles import create_job, run_local, merge
+from contrast import save_ranks
+from rarefaction import rarefy_counts, rarefaction_curves, depth_summary
 
-logging.basicConfig(format="%(asctime)s - %(levelname)s: %(message)s")
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+)
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 
-def rarefy_counts(counts, depth=10000):
-    """Normalize a count matrix by rarefaction (subsampling).
-
-    Parameters
-    ----------
-    counts : pandas.DataFrame
-        The count matrix to be normalized. Contains variables as columns and
-        samples as rows.
+log.info("Reading genus-level data.")
+genera = open_dataset(
+    path.join("..", "data", "american_gut_genus.csv"),
+    path.join("..", "data", "metadata.tsv"),
+    path.join("..", "data", "columnar"),
+)
 
-    Returns
-    -------
-    pandas.DataFrame
-        A new data frame with normalized samples such that each sample has
-        a depth of `depth` (sum of variables equals depth).
+mat = genera.rollup("Genus").collect()
 
-    """
-    log.info(
-        "Subsampling %dx%d count matrix to a depth of %d."
-        % (counts.shape[0], counts.shape[1], depth)
-    )
-    bad = counts.astype("int").sum(1) < depth
-    log.info("Removing %d samples due to low depth." % bad.sum())
-    rare = counts[~bad].apply(
-        lambda x: pd.Series(
-            subsample_counts(x.astype("int"), depth), index=counts.columns
-        ),
-        axis=1,
-    )
-    return rare
+# Check how the rarefaction depth affects the number of samples we keep and
+# the richness we can observe
+log.info("Calculating rarefaction curves.")
+curves = rarefaction_curves(mat)
+log.info("Rarefaction summary:\n%s" % depth_summary(curves).to_string())
+curves.to_csv("rarefaction.csv")
 
+# A fixed seed gives the same rarefied data on every run, so an interrupted
+# distance job below is resumed instead of rejected
+mat = rarefy_counts(mat, 1000, seed=42)
 
-log.info("Reading genus-level data.")
-genera = pd.read_csv(
-    path.join("..", "data", "american_gut_genus.csv"), dtype={"id": str}
-)
-libsize = genera.groupby("id")["count"].sum()
+# The ranks of each genus across all samples let the app find the genera
+# that are distinctive for a group of neighbours
+log.info("Ranking genus abundances and saving them to `ranks.npy`.")
+save_ranks(mat.div(mat.sum(axis=1), axis=0))
 
-mat = pd.pivot_table(
-    genera,
-    columns="Genus",
-    index="id",
-    values="count",
-    fill_value=0,
-    aggfunc="sum",
-)
-mat = rarefy_counts(mat, 1000)
+# The distances are calculated in tiles by several worker processes. Workers
+# on other hosts sharing this directory can help out by running
+# `python tiles.py work distance_job`
+log.info("Calculating beta diversity.")
+create_job("distance_job", mat.values, mat.index)
+run_local("distance_job")
+merge("distance_job", "distances")
 
-log.info("Calculating beta diversity and PCoA.")
-D = beta_diversity("braycurtis", mat.values, mat.index, validate=True)
+# The distances are kept so the subgroup ordinations can be recomputed from
+# slices of the matrix with `python ordination.py`
+log.info("Calculating PCoA.")
+distances, ids = load_distances("distances")
+D = DistanceMatrix(np.array(distances), ids)
 red = pcoa(D, number_of_dimensions=2)
 
 log.info("Saving results to `pcoa.csv`.")
 red.samples.to_csv("pcoa.csv")
+
+log.info("Calculating subgroup ordinations.")
+ordinations = subgroup_ordinations(distances, ids, genera)
+log.info("Saving results to `pcoa_subgroups.csv`.")
+ordinations.to_csv("pcoa_subgroups.csv")
@@ -0,0 +1,127 @@
+"""Which genera are distinctive for a group of individuals?
+
+Compares a group against the whole cohort with Mann-Whitney U tests for all
+genera at once. The ranks of every genus over the cohort are computed once,
+so a test only needs to sum the ranks of the group members.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, rankdata
+
+
+def genus_ranks(relative):
+    """Rank every genus across the cohort.
+
+    Parameters
+    ----------
+    relative : pandas.DataFrame
+        Relative abundances with samples as rows and genera as columns.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The average ranks (float32, same shape as `relative`) and the tie
+        correction `sum(t**3 - t)` over all groups of tied values for each
+        genus.
+
+    """
+    values = relative.values
+    ranks = rankdata(values, axis=0).astype("float32")
+    ties = np.zeros(values.shape[1])
+    for j in range(values.shape[1]):
+        _, t = np.unique(values[:, j], return_counts=True)
+        ties[j] = np.sum(t.astype(float) ** 3 - t)
+    return ranks, ties
+
+
+def save_ranks(relative, prefix="ranks"):
+    """Rank a relative abundance matrix and save the result.
+
+    Parameters
+    ----------
+    relative : pandas.DataFrame
+        Relative abundances with samples as rows and genera as columns.
+    prefix : str
+        The ranks are saved to `<prefix>.npy`, the tie corrections to
+        `<prefix>_ties.npy` and the sample ids and genus names to
+        `<prefix>_ids.npy` and `<prefix>_genera.npy`.
+
+    """
+    ranks, ties = genus_ranks(relative)
+    np.save(prefix + ".npy", ranks)
+    np.save(prefix + "_ties.npy", ties)
+    np.save(prefix + "_ids.npy", np.array(relative.index, dtype="S"))
+    np.save(
+        prefix + "_genera.npy",
+        np.char.encode(np.array(relative.columns, dtype=str), "utf-8"),
+    )
+
+
+def load_ranks(prefix="ranks"):
+    """Load ranks saved with `save_ranks`.
+
+    Returns
+    -------
+    tuple
+        The memory-mapped ranks, the tie corrections, the sample ids and
+        the genus names.
+
+    """
+    return (
+        np.load(prefix + ".npy", mmap_mode="r"),
+        np.load(prefix + "_ties.npy"),
+        np.load(prefix + "_ids.npy").astype(str),
+        np.char.decode(np.load(prefix + "_genera.npy"), "utf-8"),
+    )
+
+
+def fdr(pvalues):
+    """Adjust p-values with the Benjamini-Hochberg procedure."""
+    pvalues = np.asarray(pvalues, dtype=float)
+    n = pvalues.shape[0]
+    order = np.argsort(pvalues)
+    adjusted = pvalues[order] * n / np.arange(1, n + 1)
+    adjusted = np.minimum.accumulate(adjusted[::-1])[::-1]
+    qvalues = np.empty(n)
+    qvalues[order] = np.minimum(adjusted, 1.0)
+    return qvalues
+
+
+def contrast(ranks, ties, members, genera):
+    """Test all genera for enrichment or depletion in a group.
+
+    Parameters
+    ----------
+    ranks : numpy.ndarray
+        The genus ranks across the cohort as returned by `genus_ranks`.
+    ties : numpy.ndarray
+        The tie corrections as returned by `genus_ranks`.
+    members : numpy.ndarray
+        Row positions of the group members in `ranks`.
+    genera : list of str
+        The genus names for the columns of `ranks`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per genus, sorted by p-value, with the columns `genus`,
+        `auc` (probability that a member has a higher abundance than a
+        non-member, 0.5 means no difference), `z`, `p` and the FDR-adjusted
+        `q`.
+
+    """
+    n = ranks.shape[0]
+    k = len(members)
+    rest = n - k
+    # Ranks are over the whole cohort which is the group plus the rest
+    u = ranks[members].sum(axis=0, dtype="float64") - k * (k + 1) / 2
+    variance = k * rest / 12 * ((n + 1) - ties / (n * (n - 1)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (u - k * rest / 2) / np.sqrt(variance)
+        auc = u / (k * rest)
+    p = np.where(variance > 0, 2 * norm.sf(np.abs(z)), 1.0)
+    result = pd.DataFrame(
+        {"genus": genera, "auc": auc, "z": z, "p": p, "q": fdr(p)}
+    )
+    return result.sort_values("p", kind="stable").reset_index(drop=True)
@@ -0,0 +1,269 @@
+"""Lazy queries over a columnar copy of the genus table and metadata."""
+
+import logging
+import numpy as np
+import pandas as pd
+from genera import RANKS, GenusTable
+from metadata import typed_metadata, criteria_mask
+from store import source_stamp, is_current, write_store, open_store
+
+log = logging.getLogger(__name__)
+
+
+def _to_bytes(values):
+    """Convert text to a fixed-width UTF-8 byte array."""
+    return np.char.encode(np.asarray(values, dtype=str), "utf-8")
+
+
+def _from_bytes(values):
+    """Convert a fixed-width UTF-8 byte array back to text."""
+    return np.char.decode(np.asarray(values), "utf-8").astype(object)
+
+
+def build_dataset(genera_file, metadata_file, directory):
+    """Save the genus table and metadata in a columnar store.
+
+    Observations are sorted by sample so the observations of any sample are
+    a contiguous slice. Text metadata columns are dictionary-encoded.
+
+    Parameters
+    ----------
+    genera_file : str
+        The long genus CSV with columns `id`, `count` and one per rank.
+    metadata_file : str
+        The metadata TSV.
+    directory : str
+        Where to save the store.
+
+    """
+    log.info("Building columnar dataset in `%s`." % directory)
+    table = GenusTable.read(genera_file)
+    meta = typed_metadata(
+        pd.read_csv(metadata_file, dtype={"id": str}, sep="\t")
+    ).reindex(table.ids)
+    order = np.argsort(table.sample, kind="stable")
+    sizes = np.bincount(table.sample, minlength=table.n_samples)
+    arrays = {
+        "ids": _to_bytes(table.ids),
+        "indptr": np.concatenate([[0], np.cumsum(sizes)]).astype("int64"),
+        "taxon": table.taxon[order],
+        "count": table.count[order],
+    }
+    for rank in RANKS:
+        arrays["taxa_" + rank] = _to_bytes(table.taxa[rank].fillna(""))
+    for col in meta.columns:
+        if meta[col].dtype.kind in "fiub":
+            arrays["meta_" + col] = meta[col].values.astype(float)
+        else:
+            codes, categories = pd.factorize(meta[col])
+            arrays["meta_" + col] = codes.astype("int32")
+            arrays["categories_" + col] = _to_bytes(categories)
+    write_store(
+        directory,
+        arrays,
+        source_stamp([genera_file, metadata_file]),
+        columns={"metadata": list(meta.columns)},
+    )
+
+
+def open_dataset(genera_file, metadata_file, directory):
+    """Open a dataset, building it first if it is missing or outdated.
+
+    Parameters
+    ----------
+    genera_file : str
+        The long genus CSV with columns `id`, `count` and one per rank.
+    metadata_file : str
+        The metadata TSV.
+    directory : str
+        The location of the columnar store.
+
+    Returns
+    -------
+    Dataset
+        A query over all samples.
+
+    """
+    if not is_current(directory, source_stamp([genera_file, metadata_file])):
+        build_dataset(genera_file, metadata_file, directory)
+    return Dataset(directory)
+
+
+class Dataset:
+    """A lazy query over the columnar genus table and metadata.
+
+    Every method returns a new query and nothing is read until `collect`
+    or `metadata` is called. Only the metadata columns used in filters and
+    the observations of the selected samples are ever read from disk.
+
+    Examples
+    --------
+    >>> ag = Dataset("../data/columnar")
+    >>> dogs = ag.where(dog="true").rollup("Phylum")
+    >>> dogs.select(["Bacteroidetes", "Firmicutes"]).collect(relative=True)
+
+    Parameters
+    ----------
+    directory : str
+        The columnar store as written by `build_dataset`.
+    store : tuple, optional
+        The arrays and manifest of the already opened store. Queries derived
+        from each other share them so the store is only opened once.
+
+    """
+
+    def __init__(self, directory, criteria=None, ids=None, rank="Genus",
+                 columns=None, store=None):
+        self.directory = directory
+        self.criteria = criteria or {}
+        self.ids = ids
+        self.rank = rank
+        self.columns = columns
+        if store is None:
+            store = open_store(directory)
+        self._arrays, self._manifest = store
+
+    def _replace(self, **changes):
+        """Create a new query with some settings changed."""
+        settings = {
+            "criteria": self.criteria,
+            "ids": self.ids,
+            "rank": self.rank,
+            "columns": self.columns,
+            "store": (self._arrays, self._manifest),
+        }
+        settings.update(changes)
+        return Dataset(self.directory, **settings)
+
+    def where(self, **criteria):
+        """Filter samples on metadata fields.
+
+        Takes the same criteria as `metadata.criteria_mask`, for instance
+        `where(dog="true", bmi=(18.5, 25))`.
+        """
+        return self._replace(criteria=dict(self.criteria, **criteria))
+
+    def samples(self, ids):
+        """Only use the samples with the given ids."""
+        ids = set(ids) if self.ids is None else set(ids) & set(self.ids)
+        return self._replace(ids=sorted(ids))
+
+    def rollup(self, rank):
+        """Sum up the counts on a taxonomic rank."""
+        if rank not in RANKS:
+            raise ValueError("`%s` is not a taxonomic rank." % rank)
+        return self._replace(rank=rank, columns=None)
+
+    def select(self, columns):
+        """Only return the given taxa."""
+        return self._replace(columns=list(columns))
+
+    def _metadata_column(self, col, codes=None):
+        """Read and decode a single metadata column.
+
+        Only the rows in `codes` are decoded if given.
+        """
+        if col not in self._manifest["columns"]["metadata"]:
+            raise ValueError("There is no metadata field `%s`." % col)
+        values = self._arrays["meta_" + col]
+        if codes is not None:
+            values = values[codes]
+        if "categories_" + col not in self._arrays:
+            return np.asarray(values)
+        categories = _from_bytes(self._arrays["categories_" + col])
+        return pd.Categorical.from_codes(values, categories).astype(object)
+
+    def sample_codes(self):
+        """Get the positions of all samples matching the query."""
+        keep = np.ones(self._arrays["ids"].shape[0], dtype=bool)
+        if self.criteria:
+            fields = pd.DataFrame(
+                {col: self._metadata_column(col) for col in self.criteria}
+            )
+            keep &= criteria_mask(fields, self.criteria)
+        if self.ids is not None:
+            keep &= np.isin(self._arrays["ids"], _to_bytes(self.ids))
+        return np.flatnonzero(keep)
+
+    def sample_ids(self):
+        """Get the ids of all samples matching the query."""
+        return _from_bytes(self._arrays["ids"][self.sample_codes()])
+
+    def metadata(self, columns):
+        """Get metadata fields for the selected samples.
+
+        Parameters
+        ----------
+        columns : list of str
+            The metadata fields to read.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The fields with samples as rows.
+
+        """
+        codes = self.sample_codes()
+        return pd.DataFrame(
+            {col: self._metadata_column(col, codes) for col in columns},
+            index=_from_bytes(self._arrays["ids"][codes]),
+        )
+
+    def metadata_fields(self):
+        """Get the names of all metadata fields."""
+        return list(self._manifest["columns"]["metadata"])
+
+    def taxon_names(self):
+        """Get the sorted names of all taxa on the chosen rank."""
+        names = _from_bytes(self._arrays["taxa_" + self.rank])
+        return sorted(set(names) - {""})
+
+    def _taxa(self):
+        """Get the lineage table of all taxa."""
+        taxa = pd.DataFrame(
+            {rank: _from_bytes(self._arrays["taxa_" + rank]) for rank in RANKS}
+        )
+        return taxa.replace("", np.nan)
+
+    def collect(self, relative=False):
+        """Run the query.
+
+        Parameters
+        ----------
+        relative : bool
+            Whether to return fractions of the library size instead of
+            counts. The library size includes taxa that are not selected or
+            not classified on the chosen rank.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The counts or fractions with samples as rows and taxa as
+            columns.
+
+        """
+        codes = self.sample_codes()
+        indptr = self._arrays["indptr"]
+        starts, lengths = indptr[codes], indptr[codes + 1] - indptr[codes]
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        table = GenusTable(
+            _from_bytes(self._arrays["ids"][codes]),
+            self._taxa(),
+            np.repeat(np.arange(codes.shape[0], dtype="int32"), lengths),
+            self._arrays["taxon"][rows],
+            self._arrays["count"][rows],
+        )
+        libsize = table.libsize().values
+        if self.columns is not None:
+            wanted = table.taxa[self.rank].isin(self.columns).values
+            keep = wanted[table.taxon]
+            table.sample = table.sample[keep]
+            table.taxon = table.taxon[keep]
+            table.count = table.count[keep]
+        counts = table.rollup(self.rank)
+        if self.columns is not None:
+            counts = counts.reindex(columns=self.columns, fill_value=0)
+        if relative:
+            return counts / libsize[:, None]
+        return counts
@@ -0,0 +1,233 @@
+"""Stream exports of the columnar dataset in chunks.
+
+Exports are generated chunk by chunk from the columnar store, so memory use
+does not depend on the number of exported samples. The output for a query is
+deterministic, which lets clients resume interrupted downloads with HTTP
+range requests.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+from os import path
+import pandas as pd
+from flask import Response, request
+from store import manifest
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+log = logging.getLogger(__name__)
+
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def export_frames(dataset, chunk_size=1000):
+    """Read the metadata and counts of a query in chunks of samples.
+
+    Parameters
+    ----------
+    dataset : dataset.Dataset
+        The query to export. The counts are summed up on its rank.
+    chunk_size : int
+        The number of samples in each chunk.
+
+    Yields
+    ------
+    pandas.DataFrame
+        All metadata fields followed by the counts of every taxon, with
+        samples as rows. Every chunk has the same columns.
+
+    """
+    ids = dataset.sample_ids()
+    fields = dataset.metadata_fields()
+    taxa = dataset.taxon_names()
+    for start in range(0, len(ids), chunk_size):
+        chunk = dataset.samples(ids[start:start + chunk_size])
+        meta = chunk.metadata(fields)
+        counts = chunk.select(taxa).collect()
+        frame = pd.concat([meta, counts.reindex(meta.index)], axis=1)
+        yield frame.rename_axis("id").reset_index()
+
+
+def csv_chunks(frames):
+    """Encode data frames as a single CSV file."""
+    for i, frame in enumerate(frames):
+        yield frame.to_csv(header=i == 0, index=False).encode("utf-8")
+
+
+def _schema(frame):
+    """Get the Parquet schema for a chunk, storing text as strings."""
+    return pa.schema(
+        [
+            (col, pa.string())
+            if dtype.kind == "O"
+            else (col, pa.from_numpy_dtype(dtype))
+            for col, dtype in frame.dtypes.items()
+        ]
+    )
+
+
+def parquet_chunks(frames):
+    """Encode data frames as a Parquet file with one row group each."""
+    if pa is None:
+        raise ValueError("Parquet exports need `pyarrow`.")
+    sink = io.BytesIO()
+    writer = None
+    for frame in frames:
+        if writer is None:
+            schema = _schema(frame)
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(
+            pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+        )
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+def byte_range(chunks, start=0, stop=None):
+    """Cut the bytes from `start` up to `stop` out of a stream of chunks."""
+    position = 0
+    for chunk in chunks:
+        end = position + len(chunk)
+        if end > start:
+            last = len(chunk) if stop is None else stop - position
+            yield chunk[max(start - position, 0):last]
+        position = end
+        if stop is not None and position >= stop:
+            return
+
+
+def size_file(directory, etag):
+    """Get the file with the total size of an export.
+
+    The sizes are saved in the version of the store the export is read
+    from, so every server process can use them and they are removed
+    together with that version.
+    """
+    return path.join(path.realpath(directory), "exports", etag)
+
+
+def read_size(filename):
+    """Read a saved export size or get None if it is not known yet."""
+    try:
+        with open(filename) as handle:
+            return int(handle.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_size(chunks, filename):
+    """Pass on a stream of chunks and save its size once it is complete."""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    tmp = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        os.makedirs(path.dirname(filename), exist_ok=True)
+        with open(tmp, "w") as handle:
+            handle.write(str(size))
+        os.replace(tmp, filename)
+    except OSError as error:
+        log.warning("Could not save the export size: %s" % error)
+
+
+def stream_export(dataset, filename, fmt="csv", chunk_size=1000):
+    """Create a streaming download response for a query.
+
+    Supports single byte ranges (`Range` and `If-Range` headers) so
+    interrupted downloads can be resumed. The chunks before the requested
+    range are generated again and skipped, so a resumed download uses as
+    little memory as a full one.
+
+    A range can only be answered once the total size of the export is
+    known, which is saved when the export was sent in full once. Before
+    that ranges are ignored and the full export is sent, instead of
+    generating it twice to find its size.
+
+    Parameters
+    ----------
+    dataset : dataset.Dataset
+        The query to export.
+    filename : str
+        The suggested file name without extension.
+    fmt : str
+        Either `csv` or `parquet`.
+    chunk_size : int
+        The number of samples per chunk (or Parquet row group).
+
+    Returns
+    -------
+    flask.Response
+        The (partial) download.
+
+    """
+    if fmt not in FORMATS:
+        return Response("Unknown format `%s`." % fmt, status=400)
+    if fmt == "parquet" and pa is None:
+        return Response("Parquet exports are not available.", status=501)
+    encode = csv_chunks if fmt == "csv" else parquet_chunks
+
+    def chunks():
+        return encode(export_frames(dataset, chunk_size))
+
+    etag = hashlib.sha1(
+        json.dumps(
+            [
+                manifest(dataset.directory)["stamp"],
+                dataset.criteria,
+                dataset.ids,
+                dataset.rank,
+                fmt,
+                chunk_size,
+            ],
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": '"%s"' % etag,
+        "Content-Disposition": "attachment; filename=%s.%s" % (filename, fmt),
+    }
+
+    ranges = request.range
+    if_range = request.if_range
+    resume = (
+        ranges is not None
+        and len(ranges.ranges) == 1
+        and (if_range.etag is None or if_range.etag == etag)
+        and if_range.date is None
+    )
+    sizes = size_file(dataset.directory, etag)
+    size = read_size(sizes)
+    if size is None:
+        return Response(
+            save_size(chunks(), sizes), mimetype=FORMATS[fmt], headers=headers
+        )
+    if not resume:
+        return Response(chunks(), mimetype=FORMATS[fmt], headers=headers)
+
+    bounds = ranges.range_for_length(size)
+    if bounds is None:
+        headers["Content-Range"] = "bytes */%d" % size
+        return Response(status=416, headers=headers)
+    start, stop = bounds
+    headers["Content-Range"] = "bytes %d-%d/%d" % (start, stop - 1, size)
+    headers["Content-Length"] = str(stop - start)
+    return Response(
+        byte_range(chunks(), start, stop),
+        status=206,
+        mimetype=FORMATS[fmt],
+        headers=headers,
+    )
@@ -0,0 +1,208 @@
+"""Compact storage for the long genus count table."""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+RANKS = ["Kingdom", "Phylum", "Class", "Order", "Family", "Genus"]
+
+
+def _encode(values, lookup):
+    """Convert values to integer codes, adding new values to `lookup`."""
+    codes, uniques = pd.factorize(values)
+    mapping = np.array(
+        [lookup.setdefault(u, len(lookup)) for u in uniques], dtype="int32"
+    )
+    return mapping[codes]
+
+
+class GenusTable:
+    """The genus counts as integer codes in contiguous arrays.
+
+    Each unique lineage (Kingdom through Genus) is only stored once in
+    `taxa` and each sample id once in `ids`. Every observation is a triple
+    of a sample code, a taxon code and a count.
+
+    Attributes
+    ----------
+    ids : numpy.ndarray
+        The sample ids, indexed by sample code.
+    taxa : pandas.DataFrame
+        The lineage for each taxon code with one column per rank.
+    sample : numpy.ndarray of int32
+        The sample code of each observation.
+    taxon : numpy.ndarray of int32
+        The taxon code of each observation.
+    count : numpy.ndarray of uint32
+        The read count of each observation.
+
+    """
+
+    def __init__(self, ids, taxa, sample, taxon, count):
+        self.ids = ids
+        self.taxa = taxa
+        self.sample = sample
+        self.taxon = taxon
+        self.count = count
+
+    @classmethod
+    def read(cls, filename, chunksize=1000000):
+        """Read a long genus table without materializing it in memory.
+
+        Parameters
+        ----------
+        filename : str
+            A CSV file with columns `id`, `count` and one column per rank.
+        chunksize : int
+            How many rows to parse at once.
+
+        Returns
+        -------
+        GenusTable
+            The encoded table.
+
+        """
+        ids, lineages = {}, {}
+        sample, taxon, count = [], [], []
+        chunks = pd.read_csv(
+            filename,
+            dtype=dict(id=str, count="uint32", **{r: str for r in RANKS}),
+            chunksize=chunksize,
+        )
+        for chunk in chunks:
+            lineage = chunk[RANKS[0]].fillna("")
+            for rank in RANKS[1:]:
+                lineage = lineage + ";" + chunk[rank].fillna("")
+            sample.append(_encode(chunk["id"].values, ids))
+            taxon.append(_encode(lineage.values, lineages))
+            count.append(chunk["count"].values)
+
+        taxa = pd.DataFrame(
+            [lineage.split(";") for lineage in lineages], columns=RANKS
+        ).replace("", np.nan)
+        return cls(
+            np.array(list(ids), dtype=object),
+            taxa,
+            np.concatenate(sample),
+            np.concatenate(taxon),
+            np.concatenate(count),
+        )
+
+    @property
+    def n_samples(self):
+        """The number of samples."""
+        return self.ids.shape[0]
+
+    def libsize(self):
+        """Get the library size (total reads) for each sample.
+
+        Returns
+        -------
+        pandas.Series
+            The library sizes indexed by sample id.
+
+        """
+        sizes = np.bincount(
+            self.sample, weights=self.count, minlength=self.n_samples
+        )
+        return pd.Series(sizes.astype("int64"), index=self.ids, name="count")
+
+    def rank_codes(self, rank):
+        """Map taxon codes to codes on a taxonomic rank.
+
+        Parameters
+        ----------
+        rank : str
+            The taxonomic rank, for instance "Phylum".
+
+        Returns
+        -------
+        tuple
+            An int32 array giving the rank code for each taxon code (-1 if
+            the taxon is not classified on that rank) and the sorted names
+            for each rank code.
+
+        """
+        codes, names = pd.factorize(self.taxa[rank], sort=True)
+        return codes.astype("int32"), np.asarray(names, dtype=object)
+
+    def matrix(self, rank="Genus"):
+        """Sum up the counts on a taxonomic rank as a sparse matrix.
+
+        Observations not classified on that rank are dropped.
+
+        Parameters
+        ----------
+        rank : str
+            The taxonomic rank, for instance "Genus".
+
+        Returns
+        -------
+        tuple
+            The samples x taxa count matrix as `scipy.sparse.csr_matrix`
+            and the names of its columns.
+
+        """
+        codes, names = self.rank_codes(rank)
+        level = codes[self.taxon]
+        keep = level >= 0
+        mat = csr_matrix(
+            (
+                self.count[keep].astype("int64"),
+                (self.sample[keep], level[keep]),
+            ),
+            shape=(self.n_samples, names.shape[0]),
+        )
+        mat.sum_duplicates()
+        return mat, names
+
+    def rollup(self, rank="Phylum", relative=False):
+        """Sum up the counts on a taxonomic rank as a dense table.
+
+        Parameters
+        ----------
+        rank : str
+            The taxonomic rank, for instance "Phylum".
+        relative : bool
+            Whether to divide by the library size. The library size includes
+            reads that are not classified on `rank`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The counts or fractions with samples as rows and taxa as
+            columns.
+
+        """
+        codes, names = self.rank_codes(rank)
+        level = codes[self.taxon]
+        keep = level >= 0
+        flat = np.bincount(
+            self.sample[keep].astype("int64") * names.shape[0] + level[keep],
+            weights=self.count[keep],
+            minlength=self.n_samples * names.shape[0],
+        ).reshape(self.n_samples, names.shape[0])
+        if relative:
+            flat /= self.libsize().values[:, None]
+        else:
+            flat = flat.astype("int64")
+        return pd.DataFrame(flat, index=self.ids, columns=names)
+
+    def pivot(self, rank="Genus"):
+        """Get the dense count matrix with samples as rows.
+
+        Equivalent to a pivot table of the long table summed on `rank`.
+
+        Parameters
+        ----------
+        rank : str
+            The taxonomic rank, for instance "Genus".
+
+        Returns
+        -------
+        pandas.DataFrame
+            The counts with samples as rows and taxa as columns.
+
+        """
+        mat, names = self.matrix(rank)
+        return pd.DataFrame(mat.toarray(), index=self.ids, columns=names)
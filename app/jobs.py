@@ -0,0 +1,286 @@
+"""A small local job queue for expensive per-user computations."""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting or running."""
+
+
+def job_key(fun, args):
+    """Get an identifier that is the same for identical submissions.
+
+    Parameters
+    ----------
+    fun : callable
+        A module-level function.
+    args : tuple
+        The (picklable) arguments for the function.
+
+    Returns
+    -------
+    str
+        A hash of the function name and its arguments.
+
+    """
+    payload = pickle.dumps((fun.__module__, fun.__qualname__, args))
+    return hashlib.sha1(payload).hexdigest()
+
+
+class JobQueue:
+    """Run functions in a pool of worker processes and poll for results.
+
+    Jobs are identified by a hash of the function and its arguments, so
+    submitting the same work twice will not run it twice. Functions and
+    arguments must be picklable, so only use module-level functions.
+
+    Running jobs can not be interrupted by the process pool. A job that
+    exceeds its timeout is reported as timed out but keeps counting towards
+    the queue size until its worker is free again, so slow jobs can never
+    pile up beyond `max_pending`.
+
+    With a `directory` the state of submitted jobs and their results are
+    also saved to disk. Several server processes sharing the directory (for
+    instance the workers of `gunicorn --preload`) can then answer polls for
+    jobs submitted to any of them and never run the same job twice.
+
+    The pool is only started on the first submission in each process. A
+    queue created before forking (as with `gunicorn --preload`) thus gives
+    every forked process its own pool and `max_pending` instead of sharing
+    the pipes of a pool started in the parent.
+
+    Parameters
+    ----------
+    workers : int
+        The number of worker processes.
+    max_pending : int
+        The maximum number of jobs that may wait or run at the same time.
+    timeout : float
+        Seconds after submission after which a job is given up.
+    keep : int
+        How many finished results to keep around for polling.
+    directory : str, optional
+        A directory to share job states and results between processes.
+
+    """
+
+    def __init__(self, workers=2, max_pending=16, timeout=60, keep=256,
+                 directory=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.keep = keep
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        """Forget the pool and jobs of the process that created the queue."""
+        self.pid = os.getpid()
+        self.executor = None
+        self.jobs = OrderedDict()
+        # Timed out jobs that were submitted again but are still running
+        self.abandoned = []
+        self.lock = threading.Lock()
+
+    def _check_process(self):
+        """Start over after being forked into a new process.
+
+        Futures and the lock belong to the parent process and the pool
+        pipes must not be shared, so a forked process starts with its own.
+        """
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def pending(self):
+        """Get the number of jobs that are waiting or running."""
+        self._check_process()
+        self.abandoned = [f for f in self.abandoned if not f.done()]
+        return len(self.abandoned) + sum(
+            not job["future"].done() for job in self.jobs.values()
+        )
+
+    def submit(self, fun, *args):
+        """Submit a job.
+
+        Parameters
+        ----------
+        fun : callable
+            A module-level function.
+        *args
+            Picklable arguments passed to `fun`.
+
+        Returns
+        -------
+        str
+            The job id used to poll for the result.
+
+        Raises
+        ------
+        QueueFull
+            If there are already `max_pending` unfinished jobs.
+
+        """
+        key = job_key(fun, args)
+        self._check_process()
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and self._state(job) in ("pending", "done"):
+                self.jobs.move_to_end(key)
+                return key
+            if job is None and self._shared_state(key) in ("pending", "done"):
+                return key
+            if self.pending() >= self.max_pending:
+                raise QueueFull(
+                    "There are already %d jobs in the queue." % self.max_pending
+                )
+            if job is not None and not job["future"].done():
+                self.abandoned.append(job["future"])
+            log.info("Submitting job %s (%s)." % (key, fun.__qualname__))
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self.executor.submit(fun, *args)
+            self.jobs[key] = {
+                "future": future,
+                "deadline": time.monotonic() + self.timeout,
+                "timed_out": False,
+            }
+            if self.directory is not None:
+                deadline = time.time() + self.timeout
+                self._write(key, "json", {"deadline": deadline})
+                future.add_done_callback(lambda f: self._save_result(key, f))
+            self._evict()
+        return key
+
+    def _file(self, key, extension):
+        return path.join(self.directory, "%s.%s" % (key, extension))
+
+    def _write(self, key, extension, content):
+        """Atomically write a JSON or pickle file for a job."""
+        filename = self._file(key, extension)
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        if extension == "json":
+            with open(tmp, "w") as handle:
+                json.dump(content, handle)
+        else:
+            with open(tmp, "wb") as handle:
+                pickle.dump(content, handle)
+        os.replace(tmp, filename)
+
+    def _save_result(self, key, future):
+        """Share the result of a finished job with other processes."""
+        if future.cancelled():
+            return
+        try:
+            if future.exception() is None:
+                self._write(key, "pkl", future.result())
+            else:
+                self._write(key, "failed", repr(future.exception()))
+        except OSError as error:
+            log.error("Could not save the result of job %s: %s" % (key, error))
+
+    def _shared_state(self, key):
+        """Get the state of a job submitted by any process."""
+        if self.directory is None:
+            return "unknown"
+        if path.exists(self._file(key, "pkl")):
+            return "done"
+        if path.exists(self._file(key, "failed")):
+            return "failed"
+        try:
+            with open(self._file(key, "json")) as handle:
+                deadline = json.load(handle)["deadline"]
+        except (OSError, ValueError):
+            return "unknown"
+        return "pending" if time.time() <= deadline else "timeout"
+
+    def _state(self, job):
+        """Get the state of a job and flag it if it exceeded its timeout."""
+        future = job["future"]
+        if job["timed_out"]:
+            return "timeout"
+        if future.done():
+            if future.cancelled() or future.exception() is not None:
+                return "failed"
+            return "done"
+        if time.monotonic() > job["deadline"]:
+            # This only cancels jobs still waiting for a worker, running jobs
+            # can not be interrupted and finish in the background
+            future.cancel()
+            job["timed_out"] = True
+            return "timeout"
+        return "pending"
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond `keep`."""
+        finished = [
+            key for key, job in self.jobs.items() if job["future"].done()
+        ]
+        for key in finished[: max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[key]
+        if self.directory is None:
+            return
+        states = sorted(
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".json")
+        )
+        for _, filename in states[: max(0, len(states) - self.keep)]:
+            for extension in ("json", "pkl", "failed"):
+                try:
+                    os.remove(filename[: -len("json")] + extension)
+                except FileNotFoundError:
+                    pass
+
+    def status(self, key):
+        """Poll a job.
+
+        Parameters
+        ----------
+        key : str
+            The job id as returned by `submit`.
+
+        Returns
+        -------
+        tuple
+            The state, one of "pending", "done", "failed", "timeout" or
+            "unknown", and the result of the job or None if there is none.
+
+        """
+        self._check_process()
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                state = self._shared_state(key)
+                if state != "done":
+                    return state, None
+                try:
+                    with open(self._file(key, "pkl"), "rb") as handle:
+                        return state, pickle.load(handle)
+                except FileNotFoundError:
+                    return "unknown", None
+            state = self._state(job)
+        if state == "done":
+            return state, job["future"].result()
+        if state == "failed" and not job["future"].cancelled():
+            log.error(
+                "Job %s failed: %s." % (key, job["future"].exception())
+            )
+        return state, None
+
+    def shutdown(self):
+        """Stop the worker processes of this process."""
+        if self.executor is not None and os.getpid() == self.pid:
+            self.executor.shutdown(wait=False, cancel_futures=True)
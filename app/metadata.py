@@ -0,0 +1,132 @@
+"""Typed metadata and declarative sample selection."""
+
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+# Columns that are stored as text in the metadata but are really numbers.
+# Everything that is not a number ("Not provided", "Not applicable", ...)
+# becomes NaN.
+NUMERIC = ["bmi", "birth_year", "height_cm"]
+
+NO_CONDITION = "I do not have this condition"
+DIAGNOSED = "Diagnosed by a medical professional (doctor, physician assistant)"
+
+# Criteria defining the healthy reference cohort. A string means the column
+# has to be equal to that value, a list that it has to be one of the listed
+# values and a tuple `(low, high)` that the column must lie strictly between
+# the two bounds.
+HEALTHY_CRITERIA = {
+    "cancer": NO_CONDITION,
+    "alzheimers": NO_CONDITION,
+    "cardiovascular_disease": NO_CONDITION,
+    "diabetes": NO_CONDITION,
+    "ibd": NO_CONDITION,
+    "ibs": NO_CONDITION,
+    "kidney_disease": NO_CONDITION,
+    "liver_disease": NO_CONDITION,
+    "lung_disease": NO_CONDITION,
+    "mental_illness": "false",
+    "skin_condition": NO_CONDITION,
+    "bmi": (18.5, 25.0),
+    "birth_year": (1959, 1999),
+}
+
+# Subgroups that get their own ordination in the app, using the same
+# criteria format as above.
+SUBGROUPS = {
+    "Dog owners": {"dog": "true"},
+    "Cat owners": {"cat": "true"},
+    "IBD": {"ibd": DIAGNOSED},
+    "Diabetes": {"diabetes": DIAGNOSED},
+    "Born before 1960": {"birth_year": (1900, 1960)},
+    "Born 1960 to 1979": {"birth_year": (1959, 1980)},
+    "Born 1980 or later": {"birth_year": (1979, 2020)},
+}
+
+
+def typed_metadata(metadata):
+    """Convert the numeric metadata columns to floats once.
+
+    Parameters
+    ----------
+    metadata : pandas.DataFrame
+        The raw metadata as read from `metadata.tsv`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of the metadata indexed by `sample_name` where all columns in
+        `NUMERIC` are floats.
+
+    """
+    typed = metadata.copy()
+    for col in NUMERIC:
+        if col in typed.columns:
+            typed[col] = pd.to_numeric(typed[col], errors="coerce")
+    typed.index = typed["sample_name"].values
+    return typed
+
+
+def criteria_mask(metadata, criteria):
+    """Evaluate a set of criteria as a single boolean mask.
+
+    Parameters
+    ----------
+    metadata : pandas.DataFrame
+        Typed metadata as returned by `typed_metadata`.
+    criteria : dict
+        Maps column names to a required value, a list of allowed values or
+        to a `(low, high)` tuple of exclusive bounds.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array that is True for samples matching all criteria.
+
+    """
+    masks = [np.ones(metadata.shape[0], dtype=bool)]
+    for col, value in criteria.items():
+        values = metadata[col].values
+        if isinstance(value, tuple):
+            low, high = value
+            with np.errstate(invalid="ignore"):
+                masks.append((values > low) & (values < high))
+        elif isinstance(value, list):
+            masks.append(np.isin(values, value))
+        else:
+            masks.append(values == value)
+    return np.logical_and.reduce(masks)
+
+
+def criteria_hash(criteria):
+    """Get a stable hash for a set of criteria."""
+    # repr keeps ranges (tuples) and sets of values (lists) apart
+    serialized = json.dumps(sorted((k, repr(v)) for k, v in criteria.items()))
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+def healthiest(samples, metadata, criteria=HEALTHY_CRITERIA):
+    """Summarize the phylum fractions and coordinates of healthy individuals.
+
+    Parameters
+    ----------
+    samples : pandas.DataFrame
+        The sample data frame. Must contain column `Bacteroidetes` and
+        `Firmicutes` that contain the percentage of those phyla.
+    metadata : pandas.DataFrame
+        Typed metadata as returned by `typed_metadata`.
+    criteria : dict
+        The criteria defining a healthy individual. See `criteria_mask`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The mean and standard deviation (columns) of each sample column
+        (rows) across the healthy reference cohort.
+
+    """
+    metadata = metadata.reindex(samples.index)
+    healthy = samples[criteria_mask(metadata, criteria)]
+    return pd.DataFrame({"mean": healthy.mean(), "std": healthy.std()})
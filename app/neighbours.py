@@ -0,0 +1,257 @@
+"""Find and describe the closest individuals."""
+
+import numpy as np
+import pandas as pd
+from metadata import DIAGNOSED
+
+# The largest neighbourhood that can be selected in the app
+MAX_NEIGHBOURS = 50
+
+SMOKING = [
+    "Rarely (a few times/month)",
+    "Daily",
+    "Occasionally (1-2 times/week)",
+    "Regularly (3-5 times/week)",
+]
+
+
+def _between(values, low, high):
+    """Set values outside of [low, high] to NaN."""
+    return values.where((values >= low) & (values <= high))
+
+
+# The features shown for a set of individuals as (name, icon, is_average,
+# function generating one value per individual from typed metadata).
+# Counts are sums over indicators and averages ignore missing values.
+FEATURES = [
+    ("Dogs", "dog", False, lambda m: m.dog == "true"),
+    ("Cats", "cat", False, lambda m: m.cat == "true"),
+    ("Cancer", "ribbon", False, lambda m: m.cancer == DIAGNOSED),
+    ("Diabetes", "circle", False, lambda m: m.diabetes == DIAGNOSED),
+    ("IBD", "ambulance", False, lambda m: m.ibd == DIAGNOSED),
+    (
+        "College degree",
+        "graduation-cap",
+        False,
+        lambda m: m.level_of_education == "Bachelor's degree",
+    ),
+    ("Average age", "child", True, lambda m: 2019 - m.birth_year),
+    ("Average BMI", "weight", True, lambda m: _between(m.bmi, 13, 40)),
+    (
+        "Average height (cm)",
+        "ruler-vertical",
+        True,
+        lambda m: _between(m.height_cm, 130, 220),
+    ),
+    (
+        "Alcohol Consumption",
+        "beer",
+        False,
+        lambda m: m.alcohol_consumption == "true",
+    ),
+    (
+        "Cardiovascular disease",
+        "heartbeat",
+        False,
+        lambda m: m.cardiovascular_disease == DIAGNOSED,
+    ),
+    ("Females", "female", False, lambda m: m.sex == "female"),
+    ("Smokers", "smoking", False, lambda m: m.smoking_frequency.isin(SMOKING)),
+]
+
+
+def metadata_features(metadata):
+    """Convert metadata to a numeric matrix of the described features.
+
+    Parameters
+    ----------
+    metadata : pandas.DataFrame
+        Typed metadata as returned by `metadata.typed_metadata`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per individual and one float column per entry in `FEATURES`.
+        Missing values are NaN.
+
+    """
+    return pd.DataFrame(
+        {
+            name: fun(metadata).astype(float).values
+            for name, _, _, fun in FEATURES
+        },
+        index=metadata.index,
+    )
+
+
+def closest(bacteroidetes, firmicutes, samples, n=5):
+    """Find the positions of the members closest to the input.
+
+    Parameters
+    ----------
+    bacteroidetes : float in [0, 1]
+        The fraction of bacteroides.
+    firmicutes : float in [0, 1]
+        The fraction of firmicutes.
+    samples : pandas.DataFrame or numpy.ndarray
+        The sample data frame. Must contain column `Bacteroidetes` and
+        `Firmicutes` that contain the percentage of those phyla. Can also be
+        an array with those two columns.
+    n : int
+        How many individuals to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        The row positions of the n closest individuals ordered by distance.
+
+    """
+    if isinstance(samples, pd.DataFrame):
+        samples = samples[["Bacteroidetes", "Firmicutes"]].values
+    distance = np.hypot(
+        samples[:, 0] - bacteroidetes, samples[:, 1] - firmicutes
+    )
+    n = min(n, distance.shape[0])
+    if n < distance.shape[0]:
+        candidates = np.argpartition(distance, n)[:n]
+    else:
+        candidates = np.arange(distance.shape[0])
+    return candidates[np.argsort(distance[candidates], kind="stable")]
+
+
+def neighbour_grid(samples, n=MAX_NEIGHBOURS, steps=100):
+    """Precompute the closest individuals for all slider positions.
+
+    Parameters
+    ----------
+    samples : pandas.DataFrame or numpy.ndarray
+        The samples to search, see `closest`.
+    n : int
+        How many individuals to keep for each position.
+    steps : int
+        The number of slider steps between 0 and 1.
+
+    Returns
+    -------
+    numpy.ndarray
+        An int32 array where entry `[b, f]` holds the row positions of the n
+        individuals closest to `b / steps` Bacteroidetes and `f / steps`
+        Firmicutes.
+
+    """
+    n = min(n, samples.shape[0])
+    grid = np.zeros((steps + 1, steps + 1, n), dtype="int32")
+    for b in range(steps + 1):
+        for f in range(steps + 1):
+            grid[b, f] = closest(b / steps, f / steps, samples, n)
+    return grid
+
+
+def find_closest(bacteroidetes, firmicutes, samples, n=5):
+    """Find the id of the members closest to the input.
+
+    Parameters
+    ==========
+    bacteroidetes : float in [0, 1]
+        The fraction of bacteroides.
+    firmicutes : float in [0, 1]
+        The fraction of firmicutes.
+    samples : pandas.DataFrame
+        The sample data frame. Must contain column `Bacteroidetes` and
+        `Firmicutes` that contain the percentage of those phyla.
+    n : int
+        How many individuals to return.
+
+    Returns
+    =======
+    list of str
+        The id of the n closest individuals.
+    """
+    positions = closest(bacteroidetes, firmicutes, samples, n)
+    return samples.index[positions].tolist()
+
+
+def neighbourhood(order, features):
+    """Precompute the statistics for all neighbourhood sizes.
+
+    The features are sorted by distance and summed up cumulatively so the
+    statistics for the k closest individuals are a single lookup.
+
+    Parameters
+    ----------
+    order : numpy.ndarray
+        Row positions of the neighbours ordered by distance.
+    features : pandas.DataFrame or numpy.ndarray
+        The features of all individuals as returned by `metadata_features`.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The cumulative sums of the features and the cumulative number of
+        non-missing values. Row `k` describes the k closest neighbours.
+
+    """
+    values = np.asarray(features)[order]
+    present = ~np.isnan(values)
+    empty = np.zeros((1, values.shape[1]))
+    return (
+        np.vstack([empty, np.cumsum(np.where(present, values, 0.0), axis=0)]),
+        np.vstack([empty, np.cumsum(present, axis=0)]),
+    )
+
+
+def describe_neighbourhood(stats, k):
+    """Describe the k closest neighbours.
+
+    Parameters
+    ----------
+    stats : tuple of numpy.ndarray
+        The cumulative statistics as returned by `neighbourhood`.
+    k : int
+        The number of neighbours to describe.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The characteristics of the neighbours with columns `names`,
+        `values` and `icon`.
+    """
+    sums, counts = stats
+    if k < 0 or k >= sums.shape[0]:
+        raise ValueError("k must be between 0 and %d." % (sums.shape[0] - 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = sums[k] / counts[k]
+    return pd.DataFrame(
+        {
+            "names": [name for name, _, _, _ in FEATURES],
+            "values": [
+                averages[i] if is_average else sums[k, i]
+                for i, (_, _, is_average, _) in enumerate(FEATURES)
+            ],
+            "icon": [icon for _, icon, _, _ in FEATURES],
+        }
+    )
+
+
+def describe(samples, metadata):
+    """Give representative information for set of samples.
+
+    Parameters
+    ==========
+    samples : pandas.Series
+        The samples to describe.
+    metadata : pandas.DataFrame
+        Typed metadata for all samples as returned by
+        `metadata.typed_metadata`.
+
+    Returns
+    =======
+    pandas.DataFrame
+        The characteristics of the samples with columns `names`, `values`
+        and `icon`. For instance:
+        - "Dogs": How many of the individuals have a dog?
+        - "IBD": How many of the individuals have IBD?
+    """
+    features = metadata_features(metadata.reindex(samples.index))
+    stats = neighbourhood(np.arange(samples.shape[0]), features)
+    return describe_neighbourhood(stats, samples.shape[0])
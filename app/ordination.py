@@ -0,0 +1,87 @@
+"""Ordinations for subgroups reusing the stored distance matrix.
+
+Run this file directly to recompute the subgroup ordinations after changing
+`metadata.SUBGROUPS` without recalculating any distances.
+"""
+
+import logging
+from os import path
+import numpy as np
+import pandas as pd
+from skbio import DistanceMatrix
+from skbio.stats.ordination import pcoa
+from metadata import SUBGROUPS
+
+log = logging.getLogger(__name__)
+
+
+def load_distances(prefix="distances"):
+    """Memory-map a distance matrix written by `tiles.merge`.
+
+    Returns
+    -------
+    tuple
+        The (memory-mapped) distances and the sample ids.
+
+    """
+    distances = np.load(prefix + ".npy", mmap_mode="r")
+    ids = np.load(prefix + "_ids.npy").astype(str)
+    return distances, ids
+
+
+def subgroup_ordinations(distances, ids, dataset, subgroups=SUBGROUPS):
+    """Run a PCoA for each subgroup on a slice of the distance matrix.
+
+    Parameters
+    ----------
+    distances : numpy.ndarray
+        The square distance matrix for all samples.
+    ids : numpy.ndarray
+        The sample ids for the rows of `distances`.
+    dataset : dataset.Dataset
+        Used to find the members of each subgroup.
+    subgroups : dict
+        Maps subgroup names to metadata criteria, see
+        `metadata.criteria_mask`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The coordinates with columns `subgroup`, `PC1` and `PC2` indexed by
+        sample id.
+
+    """
+    ordinations = []
+    for name, criteria in subgroups.items():
+        members = np.flatnonzero(
+            np.isin(ids, dataset.where(**criteria).sample_ids())
+        )
+        if members.shape[0] < 3:
+            log.warning("Skipping subgroup `%s` with too few samples." % name)
+            continue
+        log.info("Running PCoA for `%s` (%d samples)." % (name, len(members)))
+        sub = DistanceMatrix(
+            np.asarray(distances[np.ix_(members, members)]), ids[members]
+        )
+        coords = pcoa(sub, number_of_dimensions=2).samples
+        coords.insert(0, "subgroup", name)
+        ordinations.append(coords)
+    if not ordinations:
+        return pd.DataFrame(columns=["subgroup", "PC1", "PC2"])
+    return pd.concat(ordinations)
+
+
+if __name__ == "__main__":
+    from dataset import open_dataset
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s: %(message)s")
+    log.setLevel(logging.INFO)
+    distances, ids = load_distances()
+    genera = open_dataset(
+        path.join("..", "data", "american_gut_genus.csv"),
+        path.join("..", "data", "metadata.tsv"),
+        path.join("..", "data", "columnar"),
+    )
+    ordinations = subgroup_ordinations(distances, ids, genera)
+    log.info("Saving results to `pcoa_subgroups.csv`.")
+    ordinations.to_csv("pcoa_subgroups.csv")
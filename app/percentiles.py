@@ -0,0 +1,95 @@
+"""Percentile lookups against the full cohort."""
+
+import re
+import numpy as np
+import pandas as pd
+
+
+def ratio(bacteroidetes, firmicutes):
+    """Get the Bacteroidetes to Firmicutes ratio.
+
+    Individuals without Firmicutes have an infinite ratio.
+    """
+    bacteroidetes = np.asarray(bacteroidetes, dtype=float)
+    firmicutes = np.asarray(firmicutes, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(firmicutes > 0, bacteroidetes / firmicutes, np.inf)
+
+
+def alpha_diversity(filename):
+    """Read the alpha diversity metrics averaged over all rarefactions.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the alpha diversity table with one column per metric and
+        rarefaction, for instance `shannon_1250_3`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The average of each metric (columns) for each sample (rows).
+
+    """
+    alpha = pd.read_csv(filename, sep="\t", index_col=0, dtype={0: str})
+    metrics = [re.sub(r"(_\d+_\d+|\.\d+)$", "", col) for col in alpha.columns]
+    return alpha.T.groupby(metrics).mean().T
+
+
+def percentile_index(cohort, alpha=None):
+    """Build the sorted empirical distributions used for percentile lookups.
+
+    Parameters
+    ----------
+    cohort : pandas.DataFrame
+        All samples. Must contain column `Bacteroidetes` and `Firmicutes`.
+    alpha : pandas.DataFrame, optional
+        Alpha diversity metrics as returned by `alpha_diversity`.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Sorted values for "Bacteroidetes", "Firmicutes", "ratio" and each
+        alpha diversity metric. Missing values are dropped.
+
+    """
+    columns = {
+        "Bacteroidetes": cohort["Bacteroidetes"].values,
+        "Firmicutes": cohort["Firmicutes"].values,
+        "ratio": ratio(cohort["Bacteroidetes"], cohort["Firmicutes"]),
+    }
+    if alpha is not None:
+        for metric in alpha.columns:
+            columns[metric] = alpha[metric].values
+    return {
+        name: np.sort(values[~np.isnan(values)])
+        for name, values in columns.items()
+    }
+
+
+def percentile(index, name, value):
+    """Get the percentage of the cohort with a value below `value`.
+
+    Ties do not count, so individuals with the same value are never
+    reported as having less.
+
+    Parameters
+    ----------
+    index : dict of numpy.ndarray
+        The index as returned by `percentile_index`.
+    name : str
+        The variable to look up.
+    value : float
+        The value to locate in the cohort.
+
+    Returns
+    -------
+    float in [0, 100]
+        The percentage of individuals with a lower value.
+
+    """
+    values = index[name]
+    if values.shape[0] == 0:
+        return np.nan
+    rank = np.searchsorted(values, value, side="left")
+    return 100.0 * rank / values.shape[0]
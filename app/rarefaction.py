@@ -0,0 +1,142 @@
+"""Rarefaction of count matrices and analytic rarefaction curves.
+
+Run this file directly to see how the choice of the rarefaction depth affects
+the number of retained samples and their richness.
+"""
+
+import logging
+from os import path
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
+from scipy.special import gammaln
+
+log = logging.getLogger(__name__)
+
+# Depths to evaluate when choosing a rarefaction depth
+DEPTHS = [100, 250, 500, 750, 1000, 1250, 1500, 2000, 3000, 5000, 7500, 10000]
+
+
+def rarefy_counts(counts, depth=10000, seed=None):
+    """Normalize a count matrix by rarefaction (subsampling).
+
+    Parameters
+    ----------
+    counts : pandas.DataFrame
+        The count matrix to be normalized. Contains variables as columns and
+        samples as rows.
+    depth : int
+        The number of reads to draw from each sample without replacement.
+    seed : int or numpy.random.Generator, optional
+        Seed for the random draws.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A new data frame with normalized samples such that each sample has
+        a depth of `depth` (sum of variables equals depth).
+
+    """
+    log.info(
+        "Subsampling %dx%d count matrix to a depth of %d."
+        % (counts.shape[0], counts.shape[1], depth)
+    )
+    values = counts.values.astype("int64")
+    bad = values.sum(1) < depth
+    log.info("Removing %d samples due to low depth." % bad.sum())
+    rng = np.random.default_rng(seed)
+    values = values[~bad]
+    rare = np.zeros_like(values)
+    for i in range(values.shape[0]):
+        observed = values[i] > 0
+        rare[i, observed] = rng.multivariate_hypergeometric(
+            values[i, observed], depth
+        )
+    return pd.DataFrame(rare, index=counts.index[~bad], columns=counts.columns)
+
+
+def rarefaction_curves(counts, depths=DEPTHS):
+    """Calculate the expected number of observed taxa at several depths.
+
+    Uses the closed form of the hypergeometric expectation: a taxon with
+    `n` of the `N` reads of a sample is missed in a subsample of `d` reads
+    with probability `C(N - n, d) / C(N, d)`. All samples are handled at once
+    by working on the non-zero entries of the sparse count matrix.
+
+    Parameters
+    ----------
+    counts : pandas.DataFrame or scipy.sparse matrix
+        The counts with samples as rows and taxa as columns.
+    depths : list of int
+        The subsampling depths.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The expected richness for each sample (rows) and depth (columns).
+        Samples with fewer reads than a depth are NaN for that depth.
+
+    """
+    index = counts.index if isinstance(counts, pd.DataFrame) else None
+    if not issparse(counts):
+        counts = np.asarray(counts)
+    counts = csr_matrix(counts, dtype="float64")
+    counts.eliminate_zeros()
+    libsize = np.asarray(counts.sum(axis=1)).ravel()
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    total = libsize[rows]
+    rest = total - counts.data
+    curves = np.full((counts.shape[0], len(depths)), np.nan)
+    for j, depth in enumerate(depths):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            log_missed = (
+                gammaln(rest + 1)
+                - gammaln(rest - depth + 1)
+                + gammaln(total - depth + 1)
+                - gammaln(total + 1)
+            )
+            missed = np.where(rest >= depth, np.exp(log_missed), 0.0)
+        richness = np.bincount(
+            rows, weights=1.0 - missed, minlength=counts.shape[0]
+        )
+        curves[:, j] = np.where(libsize >= depth, richness, np.nan)
+    return pd.DataFrame(curves, index=index, columns=list(depths))
+
+
+def depth_summary(curves):
+    """Summarize rarefaction curves for choosing a depth.
+
+    Parameters
+    ----------
+    curves : pandas.DataFrame
+        The curves as returned by `rarefaction_curves`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        For each depth the number of retained samples and the mean and
+        median expected richness of those samples.
+
+    """
+    return pd.DataFrame(
+        {
+            "samples": curves.notna().sum(),
+            "mean_richness": curves.mean(),
+            "median_richness": curves.median(),
+        }
+    ).rename_axis("depth")
+
+
+if __name__ == "__main__":
+    from dataset import open_dataset
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s: %(message)s")
+    log.setLevel(logging.INFO)
+    genera = open_dataset(
+        path.join("..", "data", "american_gut_genus.csv"),
+        path.join("..", "data", "metadata.tsv"),
+        path.join("..", "data", "columnar"),
+    )
+    log.info("Calculating rarefaction curves.")
+    curves = rarefaction_curves(genera.rollup("Genus").collect())
+    print(depth_summary(curves).to_string())
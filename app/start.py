@@ -1,239 +1,36 @@
 """Stuff to run on app startup."""
 
-import pickle
+import logging
 import numpy as np
 import pandas as pd
 from os import path
 import plotly.figure_factory as ff
 import plotly.graph_objs as go
+from metadata import (
+    HEALTHY_CRITERIA,
+    criteria_hash,
+    typed_metadata,
+    healthiest,
+)
+from neighbours import (
+    MAX_NEIGHBOURS,
+    metadata_features,
+    closest,
+    neighbour_grid,
+    neighbourhood,
+    describe_neighbourhood,
+)
+from percentiles import alpha_diversity, percentile_index
+from dataset import open_dataset
+from store import source_stamp, is_current, write_store, open_store
+from contrast import load_ranks
 
-def find_closest(bacteroidetes, firmicutes, samples, n=5):
-    """Find the id of the members closest to the input.
-    Parameters
-    ==========
-    bacteroidetes : float in [0, 1]
-        The fraction of bacteroides.
-    firmicutes : float in [0, 1]
-        The fraction of firmicutes.
-    samples : pandas.DataFrame
-        The sample data frame. Must contain column `Bacteroidetes` and
-        `Firmicutes` that contain the percentage of those phyla.
-    Returns
-    =======
-    list of str
-        The id of the n closest individuals.
-    """
-    distance = list()
-    for index, row in samples.iterrows():
-        distance.append(
-            np.sqrt(
-                (np.square(row["Bacteroidetes"] - bacteroidetes))
-                + (np.square(row["Firmicutes"] - firmicutes))
-            )
-        )
-    samples["Distance"] = distance
-    samples = samples.sort_values(by="Distance")
-    id = samples.index
-    sorted_id = id.tolist()
-    top_5 = sorted_id[0:5]
+log = logging.getLogger(__name__)
 
-    return top_5
+# The name of the ordination containing all participants
+ALL = "All participants"
 
 
-def describe(samples, metadata):
-    """Give representative information for set of samples.
-    Parameters
-    ==========
-    samples : pandas.Series
-        The samples to describe.
-    metadata : pandas.DataFrame
-        The DataFrame containing additional information for all samples.
-    Returns
-    =======
-    dict
-        A dictionary containing different characteristics of the samples.
-        For instance:
-        - "dogs": How many of the individuals have a dog?
-        - "ibd": How many of the individuals have IBD?
-    """
-    import pandas as pd
-
-    sample_metadata = pd.DataFrame()
-    metadata.index = metadata["sample_name"]
-    sample_metadata = metadata.loc[samples.index]
-    samples_with_dog = sample_metadata[sample_metadata.dog == "true"].shape[0]
-    samples_with_cat = sample_metadata[sample_metadata.cat == "true"].shape[0]
-    samples_with_ibd = sample_metadata[
-        sample_metadata.ibd
-        == "Diagnosed by a medical professional (doctor, physician assistant)"
-    ].shape[0]
-    samples_with_diabetes = sample_metadata[
-        sample_metadata.diabetes
-        == "Diagnosed by a medical professional (doctor, physician assistant)"
-    ].shape[0]
-    samples_with_cardio = sample_metadata[
-        sample_metadata.cardiovascular_disease
-        == "Diagnosed by a medical professional (doctor, physician assistant)"
-    ].shape[0]
-    samples_with_cancer = sample_metadata[
-        sample_metadata.cancer
-        == "Diagnosed by a medical professional (doctor, physician assistant)"
-    ].shape[0]
-    samples_female = sample_metadata[
-        sample_metadata.sex
-        == "female"
-    ].shape[0]
-    samples_consume_alcohol = sample_metadata[
-        sample_metadata.alcohol_consumption
-        == "true"
-    ].shape[0]
-    samples_with_college = sample_metadata[
-        sample_metadata.level_of_education == "Bachelor's degree"
-    ].shape[0]
-    samples_who_smoke = sample_metadata[
-        (sample_metadata.smoking_frequency == "Rarely (a few times/month)")
-        & (sample_metadata.smoking_frequency == "Daily")
-        & (sample_metadata.smoking_frequency == "Occasionally (1-2 times/week)")
-        & (sample_metadata.smoking_frequency == "Regularly (3-5 times/week)")
-    ].shape[0]
-    sample_metadata.fillna(0)
-    sample_metadata.birth_year = sample_metadata.birth_year.replace(
-        {"Not applicable": 0}
-    )
-    sample_metadata.birth_year = sample_metadata.birth_year.replace(
-        {"Not provided": 0}
-    )
-    samples_older_70 = sample_metadata[
-        (sample_metadata.birth_year.astype(float) < 1949)
-        & (sample_metadata.birth_year.astype(float) > 1919)
-    ].shape[0]
-    sample_metadata.birth_year = sample_metadata.birth_year.replace(
-        {0: np.NaN}
-    )
-    sample_metadata.birth_year = sample_metadata.birth_year.astype(float)
-    age_average = 2019 - sample_metadata.birth_year.mean()
-    sample_metadata.bmi = sample_metadata.bmi.replace(
-        {"Not applicable": np.NaN}
-    )
-    sample_metadata.bmi = sample_metadata.bmi.replace({"Not provided": np.NaN})
-    sample_metadata.bmi = sample_metadata.bmi.replace({0: np.NaN})
-    sample_metadata.bmi = sample_metadata.bmi.astype(float)
-    sample_metadata.bmi.loc[(sample_metadata["bmi"] > 40)] = np.NaN
-    sample_metadata.bmi.loc[(sample_metadata["bmi"] < 13)] = np.NaN
-    bmi_average = sample_metadata.bmi.mean()
-
-    sample_metadata.height_cm = sample_metadata.height_cm.replace(
-        {"Not applicable": np.NaN}
-    )
-    sample_metadata.height_cm = sample_metadata.height_cm.replace(
-        {"Not provided": np.NaN}
-    )
-    sample_metadata.height_cm = sample_metadata.height_cm.replace({0: np.NaN})
-    sample_metadata.height_cm = sample_metadata.height_cm.astype(float)
-    sample_metadata.height_cm.loc[
-        (sample_metadata["height_cm"] > 220)
-    ] = np.NaN
-    sample_metadata.height_cm.loc[
-        (sample_metadata["height_cm"] < 130)
-    ] = np.NaN
-    height_average = sample_metadata.height_cm.mean()
-
-    dict = [
-        samples_with_dog,
-        samples_with_ibd,
-        samples_with_diabetes,
-        samples_with_cancer,
-        samples_with_college,
-        samples_older_70,
-        age_average,
-    ]
-    return_display = pd.DataFrame(columns=["names", "values", "icon"])
-    return_display = return_display.append(
-        {"names": "Dogs", "values": samples_with_dog, "icon": "dog"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {"names": "Cats", "values": samples_with_cat, "icon": "cat"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {"names": "Cancer", "values": samples_with_cancer, "icon": "ribbon"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Diabetes",
-            "values": samples_with_diabetes,
-            "icon": "circle",
-        },
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {"names": "IBD", "values": samples_with_ibd, "icon": "ambulance"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "College degree",
-            "values": samples_with_college,
-            "icon": "graduation-cap",
-        },
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {"names": "Average age", "values": age_average, "icon": "child"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {"names": "Average BMI", "values": bmi_average, "icon": "weight"},
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Average height (cm)",
-            "values": height_average,
-            "icon": "ruler-vertical",
-        },
-        ignore_index = True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Alcohol Consumption",
-            "values": samples_consume_alcohol,
-            "icon": "beer",
-        },
-    
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Cardiovascular disease",
-            "values": samples_with_cardio,
-            "icon": "heartbeat",
-        },
-    
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Females",
-            "values": samples_female,
-            "icon": "female",
-        },
-    
-        ignore_index=True,
-    )
-    return_display = return_display.append(
-        {
-            "names": "Smokers",
-            "values": samples_who_smoke,
-            "icon": "smoking",
-        },
-    
-        ignore_index=True,
-    )
-    return return_display
-
 def firm_plot(samples, firmicutes, healthiest_sample):
     """
      Returns a graph of the distribution of the data in a graph
@@ -358,116 +155,227 @@ def bact_plot(samples, bacteroidetes, healthiest_sample):
         
     )
     return bact
-     
-def healthiest(samples, metadata):
+
+
+def cohort_neighbours(bacteroidetes, firmicutes, k):
+    """Describe the k closest individuals among all participants.
+
+    This searches the full cohort instead of the displayed samples. The
+    search itself only takes milliseconds, it runs on the background job
+    queue so the queue and polling are in place for heavier per-user work.
+
+    Parameters
+    ==========
+    bacteroidetes : float in [0, 1]
+        The fraction of bacteroides.
+    firmicutes : float in [0, 1]
+        The fraction of firmicutes.
+    k : int
+        The number of neighbours.
+
+    Returns
+    =======
+    list of dict
+        The description of the neighbours, one dict for each characteristic.
     """
-     Return the average firmicutes and bacteroidites levels for the healthiest individuals in the metadata and standard deviation
-     Parameters
-     ==========
-     samples : pandas.DataFrame
-         The sample data frame. Must contain column `Bacteroidetes` and
-         `Firmicutes` that contain the percentage of those phyla.
-     metadata : pandas.DataFrame
-        The DataFrame containing additional information for all samples,
-        Uses birth_year, alcohol frequency, alzheimer's, bmi,   cardiovascular_disease, cancer, depression_bipolar_schizophrenia, diabetes,
-        ibd, ibs, kidney_disease, liver_disease, lung_disease, mental_illness, skin_condition
-     Returns
-     =======
-     list of two numbers
-         The bacteroidites and firmicutes ratios for the compiled healthiest individuals
-   """
-    sample_metadata = pd.DataFrame()
-    metadata.index = metadata["sample_name"]
-    sample_metadata = metadata.loc[samples.index]
-    metadata_copy = sample_metadata.copy(deep=True)
-    metadata_copy = metadata_copy[
-        metadata_copy.cancer == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.alzheimers == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.cardiovascular_disease == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.diabetes == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.ibd == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.ibs == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.kidney_disease == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.liver_disease == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.lung_disease == "I do not have this condition"
-    ]
-    metadata_copy = metadata_copy[metadata_copy.mental_illness == "false"]
-    metadata_copy = metadata_copy[
-        metadata_copy.skin_condition == "I do not have this condition"
-    ]
-    metadata_copy.bmi = metadata_copy.bmi.replace({"Not applicable": 0})
-    metadata_copy.bmi = metadata_copy.bmi.replace({"Not provided": 0})
-    metadata_copy = metadata_copy[metadata_copy.bmi.astype(float) > 18.5]
-    metadata_copy = metadata_copy[metadata_copy.bmi.astype(float) < 25.0]
-    metadata_copy.birth_year = metadata_copy.birth_year.replace(
-        {"Not applicable": 0}
+    order = closest(bacteroidetes, firmicutes, data["phyla"], n=k)
+    stats = neighbourhood(order, data["features"])
+    return describe_neighbourhood(stats, order.shape[0]).to_dict("records")
+
+
+def read_coordinates(filename):
+    """Read ordination coordinates with the sample ids as text.
+
+    The id column written by `DataFrame.to_csv` has no name, so pandas
+    ignores `dtype={0: str}` for it and parses the ids as numbers if all of
+    them look like one.
+
+    Parameters
+    ==========
+    filename : str
+        A CSV file with the sample ids in the first column.
+
+    Returns
+    =======
+    pandas.DataFrame
+        The coordinates as floats, indexed by sample id. A `subgroup` column
+        is kept as text.
+    """
+    coords = pd.read_csv(filename, dtype=str)
+    coords = coords.set_index(coords.columns[0]).rename_axis(None)
+    numeric = coords.columns.drop("subgroup", errors="ignore")
+    return coords.astype(dict.fromkeys(numeric, float))
+
+
+def build_store(directory, stamp):
+    """Read the raw data and save everything the app needs to a data store.
+
+    Parameters
+    ==========
+    directory : str
+        Where to save the store.
+    stamp : dict
+        The description of the inputs, see `store.source_stamp`.
+    """
+    # We start by opening our genus level data. It is kept in a columnar
+    # store so only the parts we ask for are read
+    genera = open_dataset(
+        sources["genera"], sources["metadata"], sources["columnar"]
     )
-    metadata_copy.birth_year = metadata_copy.birth_year.replace(
-        {"Not provided": 0}
+
+    # This is just the metadata, with the numeric columns converted only once
+    meta = typed_metadata(
+        pd.read_csv(sources["metadata"], dtype={"id": str}, sep="\t")
     )
-    metadata_copy = metadata_copy[
-        metadata_copy.birth_year.astype(float) > 1959
-    ]
-    metadata_copy = metadata_copy[
-        metadata_copy.birth_year.astype(float) < 1999
-    ]
-    id_list = metadata_copy["sample_name"].tolist()
-    healthiest_samples = samples.loc[id_list]
-    healthiest_sample = healthiest_samples.mean(axis=0)
-    return healthiest_sample
-
-
-# We start by reading our genus level data
-genera = pd.read_csv(
-    path.join("..", "data", "american_gut_genus.csv"), dtype={"id": str}
-)
 
-# Here we calculate the "library size", the total sum of counts/reads for
-# each sample
-libsize = genera.groupby("id")["count"].sum()
+    # Now we want to summarize the data on the phylum level and convert
+    # counts to fractions by dividing by the library size. We will only keep
+    # the fractions for the two phyla we're interested in
+    phyla = (
+        genera.rollup("Phylum")
+        .select(["Bacteroidetes", "Firmicutes"])
+        .collect(relative=True)
+    )
 
-# This is just the metadata
-meta = pd.read_csv(
-    path.join("..", "data", "metadata.tsv"), dtype={"id": str}, sep="\t"
-)
+    # We will load the PCoA coordinates generated in `beta_diversity.py` and
+    # merge the coordinates with the phyla abundances
+    red = read_coordinates(sources["pcoa"])
+    cohort = pd.merge(red, phyla, left_index=True, right_index=True)
+
+    # The healthy reference is defined over the full cohort and saved in the
+    # store, so it is rebuilt together with everything else when the data
+    # changes
+    healthy = healthiest(cohort, meta)
+
+    # Sorted distributions over the full cohort for percentile lookups
+    percentiles = percentile_index(cohort, alpha_diversity(sources["alpha"]))
+
+    arrays = {
+        "ids": cohort.index.values.astype("S"),
+        "coords": cohort[["PC1", "PC2"]].values,
+        "phyla": cohort[["Bacteroidetes", "Firmicutes"]].values,
+        "features": metadata_features(meta.reindex(cohort.index)).values,
+        "healthy": healthy.values,
+    }
+    for name, values in percentiles.items():
+        arrays["percentile_" + name] = values
+
+    # The genus ranks from `beta_diversity.py` are optional and are stored in
+    # the same row order as the cohort
+    genera_ranked = []
+    if path.exists(sources["ranks"]):
+        ranks, ties, ids, genus_names = load_ranks()
+        rows = pd.Index(ids).get_indexer(cohort.index)
+        if (rows < 0).any():
+            log.warning(
+                "The genus ranks are missing %d samples, rerun "
+                "`beta_diversity.py` to compare neighbourhoods."
+                % (rows < 0).sum()
+            )
+        else:
+            arrays["ranks"] = ranks[rows]
+            arrays["ties"] = ties
+            genera_ranked = genus_names
 
-# Now we want to summarize the data on the phylum level and convert counts
-# to percentages. We start by summarizing on the phylum level
-phyla = genera.groupby(["id", "Phylum"])["count"].sum().reset_index()
+    # Every ordination is a view on the cohort. The precomputed subgroup
+    # ordinations from `beta_diversity.py` are optional
+    ordinations = {ALL: red}
+    if path.exists(sources["subgroups"]):
+        subgroups = read_coordinates(sources["subgroups"])
+        for name, coords in subgroups.groupby("subgroup", sort=False):
+            ordinations[name] = coords[["PC1", "PC2"]]
 
-# Now we convert the counts to fractions by dividing by the library size
-phyla["relative"] = phyla["count"].values / libsize[phyla.id].values
+    # For each view we select up to 1000 random individuals to display and
+    # precompute their closest neighbours for every slider position
+    for i, coords in enumerate(ordinations.values()):
+        members = np.flatnonzero(cohort.index.isin(coords.index))
+        display = np.sort(
+            np.random.choice(members, min(1000, members.shape[0]), False)
+        )
+        view = "view%d_" % i
+        arrays[view + "display"] = display.astype("int32")
+        arrays[view + "coords"] = coords.loc[cohort.index[display]].values
+        # Each ordination has its own axes, so the healthy reference is
+        # placed at the mean coordinates of the healthy members of the view
+        arrays[view + "healthy"] = (
+            healthiest(coords, meta)["mean"][["PC1", "PC2"]].values
+        )
+        arrays[view + "neighbours"] = neighbour_grid(
+            cohort.iloc[display], n=MAX_NEIGHBOURS
+        )
+
+    write_store(
+        directory,
+        arrays,
+        stamp,
+        columns={
+            "healthy": [list(healthy.index), list(healthy.columns)],
+            "percentiles": list(percentiles),
+            "views": list(ordinations),
+            "genera": list(genera_ranked),
+        },
+    )
 
-# We will only keep the fractions for the two phyla we're interested in
-phyla = pd.pivot_table(
-    phyla, index="id", columns="Phylum", values="relative", fill_value=0
-)[["Bacteroidetes", "Firmicutes"]]
 
-# As a last step we will load the PCoA coordinates generated in
-# `beta_diversity.py`, select 1000 random individuals and merge the
-# coordinates with the phyla abundances
-red = pd.read_csv("pcoa.csv", index_col=0)
+sources = {
+    "genera": path.join("..", "data", "american_gut_genus.csv"),
+    "metadata": path.join("..", "data", "metadata.tsv"),
+    "alpha": path.join("..", "data", "american_gut_alpha_diversity.tsv"),
+    "pcoa": "pcoa.csv",
+    "subgroups": "pcoa_subgroups.csv",
+    "ranks": "ranks.npy",
+    "columnar": path.join("..", "data", "columnar"),
+}
+stamp = source_stamp(
+    [sources[s] for s in ("genera", "metadata", "alpha", "pcoa")]
+    + [sources[s] for s in ("subgroups", "ranks") if path.exists(sources[s])],
+    criteria=criteria_hash(HEALTHY_CRITERIA),
+    max_neighbours=MAX_NEIGHBOURS,
+)
+
+# The raw data is only read if the store is missing or outdated. Run the app
+# with a pre-forking server that loads the app in the master process (for
+# instance `gunicorn --preload app:server`) so the store is built only once
+# and all workers share the memory-mapped arrays.
+if not is_current("store", stamp):
+    build_store("store", stamp)
+data, manifest = open_store("store")
+# The columnar dataset is up to date once the store is, it backs the exports
+dataset = open_dataset(
+    sources["genera"], sources["metadata"], sources["columnar"]
+)
+
+healthy = pd.DataFrame(
+    data["healthy"],
+    index=manifest["columns"]["healthy"][0],
+    columns=manifest["columns"]["healthy"][1],
+)
+healthiest_sample = healthy["mean"]
+percentiles = {
+    name: data["percentile_" + name]
+    for name in manifest["columns"]["percentiles"]
+}
+
+# Only the displayed samples of each ordination are kept as (small)
+# DataFrames, together with their features and neighbour index
+views = {}
+for i, name in enumerate(manifest["columns"]["views"]):
+    display = data["view%d_display" % i]
+    views[name] = {
+        "samples": pd.DataFrame(
+            np.hstack([data["view%d_coords" % i], data["phyla"][display]]),
+            index=data["ids"][display].astype(str),
+            columns=["PC1", "PC2", "Bacteroidetes", "Firmicutes"],
+        ),
+        "display": display,
+        "features": data["features"][display],
+        "neighbours": data["view%d_neighbours" % i],
+        "healthy": pd.Series(data["view%d_healthy" % i], index=["PC1", "PC2"]),
+    }
+samples = views[ALL]["samples"]
 
-samples = red.sample(1000)
-meta = meta[meta.sample_name.isin(samples.index)]
-samples = pd.merge(samples, phyla, left_index=True, right_index=True)
-healthiest_sample = healthiest(samples, meta)
+# Genus ranks to find what is distinctive about a group of neighbours
+ranked_genera = manifest["columns"]["genera"]
 firm_plot = firm_plot
 bact_plot = bact_plot
 # The App will now use the samples DataFrame
@@ -0,0 +1,139 @@
+"""A read-only data store backed by memory-mapped NumPy arrays.
+
+All data needed for serving is kept in flat arrays without Python objects.
+The arrays are memory-mapped from disk, so every worker process of a WSGI
+server shares the same physical pages instead of holding its own copy.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from os import path
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+VERSION = 2
+
+# Seconds to keep a replaced store for readers that are still opening it
+RETIRE_AFTER = 60
+
+
+def source_stamp(filenames, **extra):
+    """Describe the inputs a store was built from.
+
+    Parameters
+    ----------
+    filenames : list of str
+        The input files. Their size and modification time are recorded.
+    **extra
+        Additional JSON-serializable settings that invalidate the store when
+        they change.
+
+    Returns
+    -------
+    dict
+        The stamp saved in the manifest.
+
+    """
+    files = {}
+    for filename in filenames:
+        stat = os.stat(filename)
+        files[path.basename(filename)] = [stat.st_size, int(stat.st_mtime)]
+    return {"version": VERSION, "files": files, "settings": extra}
+
+
+def manifest(directory):
+    """Read the manifest of a store or return None if there is none."""
+    filename = path.join(directory, "manifest.json")
+    if not path.exists(filename):
+        return None
+    with open(filename) as handle:
+        return json.load(handle)
+
+
+def is_current(directory, stamp):
+    """Check whether a store exists and was built from the same inputs."""
+    info = manifest(directory)
+    return info is not None and info["stamp"] == stamp
+
+
+def write_store(directory, arrays, stamp, columns=None):
+    """Save arrays as a new store.
+
+    Every store is written to a new versioned directory next to
+    `directory`, which is then atomically replaced by a symbolic link to the
+    new version. Readers therefore always see either the old or the new
+    store. Replaced versions are removed after `RETIRE_AFTER` seconds.
+
+    Parameters
+    ----------
+    directory : str
+        Where to save the store.
+    arrays : dict of numpy.ndarray
+        The arrays to save. Must not contain Python objects, so use
+        fixed-width byte strings for text.
+    stamp : dict
+        The stamp as returned by `source_stamp`.
+    columns : dict of list, optional
+        Column names for two-dimensional arrays.
+
+    """
+    directory = path.abspath(directory)
+    parent, base = path.split(directory)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".%s-" % base)
+    for name, values in arrays.items():
+        if np.asarray(values).dtype == object:
+            raise ValueError("Array `%s` contains Python objects." % name)
+        np.save(path.join(tmp, name + ".npy"), np.ascontiguousarray(values))
+    info = {"stamp": stamp, "arrays": sorted(arrays), "columns": columns or {}}
+    with open(path.join(tmp, "manifest.json"), "w") as handle:
+        json.dump(info, handle)
+    previous = path.realpath(directory) if path.islink(directory) else None
+    if path.isdir(directory) and not path.islink(directory):
+        # Stores written before versioning are plain directories
+        shutil.rmtree(directory)
+    link = "%s.%d.link" % (directory, os.getpid())
+    os.symlink(path.basename(tmp), link)
+    os.replace(link, directory)
+    if previous is not None:
+        # Remember when the previous version was replaced
+        os.utime(previous)
+    current = path.realpath(directory)
+    for version in glob.glob(path.join(parent, ".%s-*" % base)):
+        # Versions without a manifest are still being written
+        complete = path.exists(path.join(version, "manifest.json"))
+        age = time.time() - os.stat(version).st_mtime
+        if complete and version != current and age > RETIRE_AFTER:
+            shutil.rmtree(version, ignore_errors=True)
+    log.info("Saved %d arrays to `%s`." % (len(arrays), directory))
+
+
+def open_store(directory):
+    """Memory-map all arrays of a store.
+
+    Parameters
+    ----------
+    directory : str
+        The store directory.
+
+    Returns
+    -------
+    tuple
+        A dict of read-only memory-mapped arrays and the manifest.
+
+    """
+    # Resolve the link once so all arrays come from the same version
+    directory = path.realpath(directory)
+    info = manifest(directory)
+    if info is None:
+        raise ValueError("There is no data store in `%s`." % directory)
+    arrays = {
+        name: np.load(path.join(directory, name + ".npy"), mmap_mode="r")
+        for name in info["arrays"]
+    }
+    return arrays, info
@@ -0,0 +1,327 @@
+"""Compute all-pairs Bray-Curtis distances in tiles across processes and hosts.
+
+A job directory on a shared filesystem holds the input matrix and a manifest
+describing the tiles of the upper triangle of the distance matrix. Any
+number of workers, on this host or on other hosts that see the same
+directory, claim tiles through lock files created with `O_EXCL`, compute
+them and write one shard per tile. Once all shards exist they are merged
+into the full distance matrix.
+
+Usage::
+
+    python tiles.py work <job directory>      # start a worker
+    python tiles.py progress <job directory>  # show the progress
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from os import path
+import numpy as np
+from scipy.spatial.distance import cdist
+
+log = logging.getLogger(__name__)
+
+
+def _manifest(directory):
+    with open(path.join(directory, "manifest.json")) as handle:
+        return json.load(handle)
+
+
+def _shard(directory, tile):
+    return path.join(directory, "shards", "tile_%d.npy" % tile)
+
+
+def _lock(directory, tile):
+    return path.join(directory, "locks", "tile_%d.lock" % tile)
+
+
+def _failures(directory, tile):
+    """Count how often a tile has failed so far."""
+    filename = path.join(directory, "failed", "tile_%d.log" % tile)
+    if not path.exists(filename):
+        return 0
+    with open(filename) as handle:
+        return len(handle.readlines())
+
+
+def create_job(directory, data, ids, tile_size=2000):
+    """Set up a distance job in a (shared) directory.
+
+    An existing job for the same data is kept so interrupted jobs resume
+    where they stopped. A finished job for other data is replaced.
+
+    Parameters
+    ----------
+    directory : str
+        The job directory.
+    data : numpy.ndarray
+        The samples x taxa count matrix.
+    ids : list of str
+        The sample ids of the rows in `data`.
+    tile_size : int
+        The number of rows and columns in each tile.
+
+    """
+    data = np.ascontiguousarray(data, dtype="float64")
+    digest = hashlib.sha1(data.tobytes()).hexdigest()
+    if path.exists(path.join(directory, "manifest.json")):
+        if _manifest(directory)["hash"] == digest:
+            log.info("Resuming existing distance job in `%s`." % directory)
+            return
+        done, _, total = progress(directory)
+        if done < total:
+            raise ValueError(
+                "`%s` contains an unfinished job for other data." % directory
+            )
+        log.info("Replacing finished distance job in `%s`." % directory)
+        shutil.rmtree(directory)
+    for sub in ("locks", "shards", "failed"):
+        os.makedirs(path.join(directory, sub), exist_ok=True)
+    np.save(path.join(directory, "data.npy"), data)
+    np.save(path.join(directory, "ids.npy"), np.array(ids, dtype="S"))
+    bounds = list(range(0, data.shape[0], tile_size)) + [data.shape[0]]
+    tiles = [
+        [bounds[i], bounds[i + 1], bounds[j], bounds[j + 1]]
+        for i in range(len(bounds) - 1)
+        for j in range(i, len(bounds) - 1)
+    ]
+    manifest = {"hash": digest, "n": data.shape[0], "tiles": tiles}
+    tmp = path.join(directory, "manifest.json.tmp")
+    with open(tmp, "w") as handle:
+        json.dump(manifest, handle)
+    os.replace(tmp, path.join(directory, "manifest.json"))
+    log.info("Created distance job with %d tiles." % len(tiles))
+
+
+def claim(directory, tile, lease=600):
+    """Try to claim a tile.
+
+    Locks older than `lease` seconds belong to workers that died and are
+    taken over.
+
+    Returns
+    -------
+    bool
+        Whether the tile was claimed.
+
+    """
+    lock = _lock(directory, tile)
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            stale = time.time() - os.stat(lock).st_mtime > lease
+        except FileNotFoundError:
+            return False
+        if not stale:
+            return False
+        log.warning("Taking over stale lock for tile %d." % tile)
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+        return claim(directory, tile, lease)
+    with os.fdopen(fd, "w") as handle:
+        handle.write("%s:%d" % (socket.gethostname(), os.getpid()))
+    return True
+
+
+def compute_tile(directory, tile):
+    """Compute a single tile and save its shard."""
+    i0, i1, j0, j1 = _manifest(directory)["tiles"][tile]
+    data = np.load(path.join(directory, "data.npy"), mmap_mode="r")
+    distances = cdist(data[i0:i1], data[j0:j1], "braycurtis")
+    shard = _shard(directory, tile)
+    # Write to a temporary file first so a shard is never seen half-written
+    tmp = shard + ".%s-%d.tmp" % (socket.gethostname(), os.getpid())
+    with open(tmp, "wb") as handle:
+        np.save(handle, distances)
+    os.replace(tmp, shard)
+
+
+def progress(directory, max_retries=3):
+    """Get the progress of a job.
+
+    Returns
+    -------
+    tuple of int
+        The number of finished tiles, of tiles that failed `max_retries`
+        times and of all tiles.
+
+    """
+    n_tiles = len(_manifest(directory)["tiles"])
+    done = sum(path.exists(_shard(directory, t)) for t in range(n_tiles))
+    failed = sum(
+        not path.exists(_shard(directory, t))
+        and _failures(directory, t) >= max_retries
+        for t in range(n_tiles)
+    )
+    return done, failed, n_tiles
+
+
+def work(directory, lease=600, max_retries=3, poll=5):
+    """Compute tiles until none are left.
+
+    Failed tiles are retried up to `max_retries` times. The worker waits for
+    tiles claimed by other workers so it can retry them if they fail.
+
+    Parameters
+    ----------
+    directory : str
+        The job directory.
+    lease : float
+        Seconds after which the lock of an unfinished tile is considered
+        stale. Must be longer than it takes to compute a tile.
+    max_retries : int
+        How often a tile may fail before it is given up.
+    poll : float
+        Seconds to wait when all open tiles are claimed by other workers.
+
+    """
+    n_tiles = len(_manifest(directory)["tiles"])
+    while True:
+        todo = [
+            t
+            for t in range(n_tiles)
+            if not path.exists(_shard(directory, t))
+            and _failures(directory, t) < max_retries
+        ]
+        if not todo:
+            break
+        claimed = False
+        for tile in todo:
+            if path.exists(_shard(directory, tile)):
+                continue
+            if not claim(directory, tile, lease):
+                continue
+            claimed = True
+            try:
+                # Other workers may have finished the tile or failed it
+                # for the last time since `todo` was listed
+                if path.exists(_shard(directory, tile)):
+                    continue
+                if _failures(directory, tile) >= max_retries:
+                    continue
+                compute_tile(directory, tile)
+                done, _, total = progress(directory, max_retries)
+                log.info("Finished tile %d (%d/%d)." % (tile, done, total))
+            except Exception as error:
+                log.error("Tile %d failed: %s" % (tile, error))
+                failed = path.join(directory, "failed", "tile_%d.log" % tile)
+                worker = "%s:%d" % (socket.gethostname(), os.getpid())
+                with open(failed, "a") as handle:
+                    handle.write("%s %r\n" % (worker, error))
+            finally:
+                try:
+                    os.remove(_lock(directory, tile))
+                except FileNotFoundError:
+                    pass
+        if not claimed:
+            time.sleep(poll)
+
+
+def merge(directory, prefix="distances"):
+    """Merge all shards into the full distance matrix.
+
+    The matrix is written with `numpy.lib.format.open_memmap` so it never
+    has to fit into memory and can be read with `ordination.load_distances`.
+
+    Parameters
+    ----------
+    directory : str
+        The job directory.
+    prefix : str
+        The distances are saved to `<prefix>.npy` and the ids to
+        `<prefix>_ids.npy`.
+
+    """
+    manifest = _manifest(directory)
+    missing = [
+        t
+        for t in range(len(manifest["tiles"]))
+        if not path.exists(_shard(directory, t))
+    ]
+    if missing:
+        raise ValueError(
+            "%d tiles are not finished, for instance tile %d."
+            % (len(missing), missing[0])
+        )
+    n = manifest["n"]
+    distances = np.lib.format.open_memmap(
+        prefix + ".npy", mode="w+", dtype="float64", shape=(n, n)
+    )
+    for tile, (i0, i1, j0, j1) in enumerate(manifest["tiles"]):
+        shard = np.load(_shard(directory, tile))
+        distances[i0:i1, j0:j1] = shard
+        distances[j0:j1, i0:i1] = shard.T
+    distances.flush()
+    del distances
+    np.save(prefix + "_ids.npy", np.load(path.join(directory, "ids.npy")))
+    log.info(
+        "Merged %d tiles into `%s.npy`." % (len(manifest["tiles"]), prefix)
+    )
+
+
+def run_local(directory, workers=None, max_retries=3):
+    """Run several independent worker processes on this host and wait.
+
+    Workers on other hosts can join at any time with
+    `python tiles.py work <directory>`.
+
+    Parameters
+    ----------
+    directory : str
+        The job directory.
+    workers : int, optional
+        The number of processes. Defaults to the number of CPUs.
+    max_retries : int
+        How often a tile may fail before it is given up.
+
+    Raises
+    ------
+    RuntimeError
+        If some tiles failed too often.
+
+    """
+    workers = workers or os.cpu_count()
+    command = [
+        sys.executable,
+        path.abspath(__file__),
+        "work",
+        directory,
+        "--max-retries",
+        str(max_retries),
+    ]
+    processes = [subprocess.Popen(command) for _ in range(workers)]
+    for p in processes:
+        p.wait()
+    done, failed, total = progress(directory, max_retries)
+    if done < total:
+        raise RuntimeError(
+            "Only %d of %d tiles finished, %d failed." % (done, total, failed)
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Tiled distance jobs.")
+    parser.add_argument("command", choices=["work", "progress"])
+    parser.add_argument("directory", help="The job directory.")
+    parser.add_argument("--lease", type=float, default=600)
+    parser.add_argument("--max-retries", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "work":
+        work(args.directory, lease=args.lease, max_retries=args.max_retries)
+    else:
+        done, failed, total = progress(args.directory, args.max_retries)
+        print("%d of %d tiles finished, %d failed." % (done, total, failed))
@@ -6,9 +6,11 @@ def filled_bar(df, rank="Phylum", figsize=(16, 6), drop=0.01):
 
     Parameters
     ----------
-    df : pandas.DataFrame
+    df : pandas.DataFrame or dataset.Dataset
         A pandas DataFrame containing the taxa abundances. Must have columns
-        `id`, `count` and whatever is passed as `rank`.
+        `id`, `count` and whatever is passed as `rank`. Can also be a
+        (filtered) `Dataset` query from the app directory in which case only
+        the selected samples are read.
     rank : str
         Name of the taxonomy rank used for summarization.
     figsize : tuple
@@ -23,10 +25,17 @@ def filled_bar(df, rank="Phylum", figsize=(16, 6), drop=0.01):
         The filled barplot ordered by the most abundant taxon.
 
     """
-    summarized = df.groupby(["id", rank])["count"].sum().reset_index()
-    summarized["percent"] = summarized.groupby("id")["count"].apply(
-        lambda x: x / x.sum())
-    summarized = summarized.pivot(index="id", columns=rank, values="percent")
+    if hasattr(df, "collect"):
+        summarized = df.rollup(rank).collect()
+        summarized = summarized.div(summarized.sum(axis=1), axis=0)
+        # taxa absent from a sample are missing, just like in the long table
+        summarized = summarized.where(summarized > 0)
+    else:
+        summarized = df.groupby(["id", rank])["count"].sum().reset_index()
+        summarized["percent"] = summarized["count"] / summarized.groupby(
+            "id")["count"].transform("sum")
+        summarized = summarized.pivot(index="id", columns=rank,
+                                      values="percent")
     rank_means = summarized.mean()
     rank_order = (rank_means[rank_means > drop].
                   sort_values(ascending=False).index)
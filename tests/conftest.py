@@ -0,0 +1,10 @@
+"""Make the app modules and notebook helpers importable in the tests."""
+
+import sys
+from os import path
+import matplotlib
+
+matplotlib.use("Agg")
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path[:0] = [path.join(ROOT, "app"), path.join(ROOT, "notebooks")]
@@ -0,0 +1,386 @@
+"""Reference implementations the optimized code paths are checked against.
+
+These are the original, unoptimized versions of functions that were later
+replaced by faster ones. They are kept unchanged (apart from the imports)
+so the tests can compare the new code paths to them. Do not optimize them.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from skbio.stats import subsample_counts
+
+log = logging.getLogger(__name__)
+
+
+def rarefy_counts(counts, depth=10000):
+    """Normalize a count matrix by rarefaction (subsampling).
+
+    Parameters
+    ----------
+    counts : pandas.DataFrame
+        The count matrix to be normalized. Contains variables as columns and
+        samples as rows.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A new data frame with normalized samples such that each sample has
+        a depth of `depth` (sum of variables equals depth).
+
+    """
+    log.info(
+        "Subsampling %dx%d count matrix to a depth of %d."
+        % (counts.shape[0], counts.shape[1], depth)
+    )
+    bad = counts.astype("int").sum(1) < depth
+    log.info("Removing %d samples due to low depth." % bad.sum())
+    rare = counts[~bad].apply(
+        lambda x: pd.Series(
+            subsample_counts(x.astype("int"), depth), index=counts.columns
+        ),
+        axis=1,
+    )
+    return rare
+
+
+def find_closest(bacteroidetes, firmicutes, samples, n=5):
+    """Find the id of the members closest to the input.
+    Parameters
+    ==========
+    bacteroidetes : float in [0, 1]
+        The fraction of bacteroides.
+    firmicutes : float in [0, 1]
+        The fraction of firmicutes.
+    samples : pandas.DataFrame
+        The sample data frame. Must contain column `Bacteroidetes` and
+        `Firmicutes` that contain the percentage of those phyla.
+    Returns
+    =======
+    list of str
+        The id of the n closest individuals.
+    """
+    distance = list()
+    for index, row in samples.iterrows():
+        distance.append(
+            np.sqrt(
+                (np.square(row["Bacteroidetes"] - bacteroidetes))
+                + (np.square(row["Firmicutes"] - firmicutes))
+            )
+        )
+    samples["Distance"] = distance
+    samples = samples.sort_values(by="Distance")
+    id = samples.index
+    sorted_id = id.tolist()
+    top_5 = sorted_id[0:5]
+
+    return top_5
+
+
+def describe(samples, metadata):
+    """Give representative information for set of samples.
+    Parameters
+    ==========
+    samples : pandas.Series
+        The samples to describe.
+    metadata : pandas.DataFrame
+        The DataFrame containing additional information for all samples.
+    Returns
+    =======
+    dict
+        A dictionary containing different characteristics of the samples.
+        For instance:
+        - "dogs": How many of the individuals have a dog?
+        - "ibd": How many of the individuals have IBD?
+    """
+    import pandas as pd
+
+    sample_metadata = pd.DataFrame()
+    metadata.index = metadata["sample_name"]
+    sample_metadata = metadata.loc[samples.index]
+    samples_with_dog = sample_metadata[sample_metadata.dog == "true"].shape[0]
+    samples_with_cat = sample_metadata[sample_metadata.cat == "true"].shape[0]
+    samples_with_ibd = sample_metadata[
+        sample_metadata.ibd
+        == "Diagnosed by a medical professional (doctor, physician assistant)"
+    ].shape[0]
+    samples_with_diabetes = sample_metadata[
+        sample_metadata.diabetes
+        == "Diagnosed by a medical professional (doctor, physician assistant)"
+    ].shape[0]
+    samples_with_cardio = sample_metadata[
+        sample_metadata.cardiovascular_disease
+        == "Diagnosed by a medical professional (doctor, physician assistant)"
+    ].shape[0]
+    samples_with_cancer = sample_metadata[
+        sample_metadata.cancer
+        == "Diagnosed by a medical professional (doctor, physician assistant)"
+    ].shape[0]
+    samples_female = sample_metadata[
+        sample_metadata.sex
+        == "female"
+    ].shape[0]
+    samples_consume_alcohol = sample_metadata[
+        sample_metadata.alcohol_consumption
+        == "true"
+    ].shape[0]
+    samples_with_college = sample_metadata[
+        sample_metadata.level_of_education == "Bachelor's degree"
+    ].shape[0]
+    samples_who_smoke = sample_metadata[
+        (sample_metadata.smoking_frequency == "Rarely (a few times/month)")
+        & (sample_metadata.smoking_frequency == "Daily")
+        & (sample_metadata.smoking_frequency == "Occasionally (1-2 times/week)")
+        & (sample_metadata.smoking_frequency == "Regularly (3-5 times/week)")
+    ].shape[0]
+    sample_metadata.fillna(0)
+    sample_metadata.birth_year = sample_metadata.birth_year.replace(
+        {"Not applicable": 0}
+    )
+    sample_metadata.birth_year = sample_metadata.birth_year.replace(
+        {"Not provided": 0}
+    )
+    samples_older_70 = sample_metadata[
+        (sample_metadata.birth_year.astype(float) < 1949)
+        & (sample_metadata.birth_year.astype(float) > 1919)
+    ].shape[0]
+    sample_metadata.birth_year = sample_metadata.birth_year.replace(
+        {0: np.NaN}
+    )
+    sample_metadata.birth_year = sample_metadata.birth_year.astype(float)
+    age_average = 2019 - sample_metadata.birth_year.mean()
+    sample_metadata.bmi = sample_metadata.bmi.replace(
+        {"Not applicable": np.NaN}
+    )
+    sample_metadata.bmi = sample_metadata.bmi.replace({"Not provided": np.NaN})
+    sample_metadata.bmi = sample_metadata.bmi.replace({0: np.NaN})
+    sample_metadata.bmi = sample_metadata.bmi.astype(float)
+    sample_metadata.bmi.loc[(sample_metadata["bmi"] > 40)] = np.NaN
+    sample_metadata.bmi.loc[(sample_metadata["bmi"] < 13)] = np.NaN
+    bmi_average = sample_metadata.bmi.mean()
+
+    sample_metadata.height_cm = sample_metadata.height_cm.replace(
+        {"Not applicable": np.NaN}
+    )
+    sample_metadata.height_cm = sample_metadata.height_cm.replace(
+        {"Not provided": np.NaN}
+    )
+    sample_metadata.height_cm = sample_metadata.height_cm.replace({0: np.NaN})
+    sample_metadata.height_cm = sample_metadata.height_cm.astype(float)
+    sample_metadata.height_cm.loc[
+        (sample_metadata["height_cm"] > 220)
+    ] = np.NaN
+    sample_metadata.height_cm.loc[
+        (sample_metadata["height_cm"] < 130)
+    ] = np.NaN
+    height_average = sample_metadata.height_cm.mean()
+
+    dict = [
+        samples_with_dog,
+        samples_with_ibd,
+        samples_with_diabetes,
+        samples_with_cancer,
+        samples_with_college,
+        samples_older_70,
+        age_average,
+    ]
+    return_display = pd.DataFrame(columns=["names", "values", "icon"])
+    return_display = return_display.append(
+        {"names": "Dogs", "values": samples_with_dog, "icon": "dog"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {"names": "Cats", "values": samples_with_cat, "icon": "cat"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {"names": "Cancer", "values": samples_with_cancer, "icon": "ribbon"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Diabetes",
+            "values": samples_with_diabetes,
+            "icon": "circle",
+        },
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {"names": "IBD", "values": samples_with_ibd, "icon": "ambulance"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "College degree",
+            "values": samples_with_college,
+            "icon": "graduation-cap",
+        },
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {"names": "Average age", "values": age_average, "icon": "child"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {"names": "Average BMI", "values": bmi_average, "icon": "weight"},
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Average height (cm)",
+            "values": height_average,
+            "icon": "ruler-vertical",
+        },
+        ignore_index = True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Alcohol Consumption",
+            "values": samples_consume_alcohol,
+            "icon": "beer",
+        },
+    
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Cardiovascular disease",
+            "values": samples_with_cardio,
+            "icon": "heartbeat",
+        },
+    
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Females",
+            "values": samples_female,
+            "icon": "female",
+        },
+    
+        ignore_index=True,
+    )
+    return_display = return_display.append(
+        {
+            "names": "Smokers",
+            "values": samples_who_smoke,
+            "icon": "smoking",
+        },
+    
+        ignore_index=True,
+    )
+    return return_display
+
+
+def healthiest(samples, metadata):
+    """
+     Return the average firmicutes and bacteroidites levels for the healthiest individuals in the metadata and standard deviation
+     Parameters
+     ==========
+     samples : pandas.DataFrame
+         The sample data frame. Must contain column `Bacteroidetes` and
+         `Firmicutes` that contain the percentage of those phyla.
+     metadata : pandas.DataFrame
+        The DataFrame containing additional information for all samples,
+        Uses birth_year, alcohol frequency, alzheimer's, bmi,   cardiovascular_disease, cancer, depression_bipolar_schizophrenia, diabetes,
+        ibd, ibs, kidney_disease, liver_disease, lung_disease, mental_illness, skin_condition
+     Returns
+     =======
+     list of two numbers
+         The bacteroidites and firmicutes ratios for the compiled healthiest individuals
+   """
+    sample_metadata = pd.DataFrame()
+    metadata.index = metadata["sample_name"]
+    sample_metadata = metadata.loc[samples.index]
+    metadata_copy = sample_metadata.copy(deep=True)
+    metadata_copy = metadata_copy[
+        metadata_copy.cancer == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.alzheimers == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.cardiovascular_disease == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.diabetes == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.ibd == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.ibs == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.kidney_disease == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.liver_disease == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.lung_disease == "I do not have this condition"
+    ]
+    metadata_copy = metadata_copy[metadata_copy.mental_illness == "false"]
+    metadata_copy = metadata_copy[
+        metadata_copy.skin_condition == "I do not have this condition"
+    ]
+    metadata_copy.bmi = metadata_copy.bmi.replace({"Not applicable": 0})
+    metadata_copy.bmi = metadata_copy.bmi.replace({"Not provided": 0})
+    metadata_copy = metadata_copy[metadata_copy.bmi.astype(float) > 18.5]
+    metadata_copy = metadata_copy[metadata_copy.bmi.astype(float) < 25.0]
+    metadata_copy.birth_year = metadata_copy.birth_year.replace(
+        {"Not applicable": 0}
+    )
+    metadata_copy.birth_year = metadata_copy.birth_year.replace(
+        {"Not provided": 0}
+    )
+    metadata_copy = metadata_copy[
+        metadata_copy.birth_year.astype(float) > 1959
+    ]
+    metadata_copy = metadata_copy[
+        metadata_copy.birth_year.astype(float) < 1999
+    ]
+    id_list = metadata_copy["sample_name"].tolist()
+    healthiest_samples = samples.loc[id_list]
+    healthiest_sample = healthiest_samples.mean(axis=0)
+    return healthiest_sample
+
+
+def filled_bar(df, rank="Phylum", figsize=(16, 6), drop=0.01):
+    """Plot a filled bar chart for the taxa composition of each individual.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A pandas DataFrame containing the taxa abundances. Must have columns
+        `id`, `count` and whatever is passed as `rank`.
+    rank : str
+        Name of the taxonomy rank used for summarization.
+    figsize : tuple
+        The figure size as (width, height).
+    drop : float
+        Drop taxa with less than this relative abundance. Defaults to 0.01
+        meaning drop taxa less abundant than 1%.
+
+    Returns
+    -------
+    plot : maplotlib.Axes
+        The filled barplot ordered by the most abundant taxon.
+
+    """
+    summarized = df.groupby(["id", rank])["count"].sum().reset_index()
+    summarized["percent"] = summarized.groupby("id")["count"].apply(
+        lambda x: x / x.sum())
+    summarized = summarized.pivot(index="id", columns=rank, values="percent")
+    rank_means = summarized.mean()
+    rank_order = (rank_means[rank_means > drop].
+                  sort_values(ascending=False).index)
+    id_order = summarized[rank_order[0]].sort_values(ascending=False).index
+    summarized = summarized.reindex(id_order).reindex(rank_order, axis=1)
+    summarized.index = range(summarized.shape[0])
+
+    ax = summarized.plot(kind="area", stacked=True, legend=False,
+                         figsize=figsize)
+    ax.set_ylim(0, 1)
+    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    return ax
@@ -0,0 +1,155 @@
+"""Random data in the schema of the American Gut tables.
+
+The generators take a seed so Hypothesis can search over (and shrink)
+datasets by drawing seeds and sizes.
+"""
+
+import io
+import numpy as np
+import pandas as pd
+from hypothesis import strategies as st
+
+RANKS = ["Kingdom", "Phylum", "Class", "Order", "Family", "Genus"]
+PHYLA = ["Bacteroidetes", "Firmicutes", "Proteobacteria", "Actinobacteria"]
+
+NO_CONDITION = "I do not have this condition"
+DIAGNOSED = "Diagnosed by a medical professional (doctor, physician assistant)"
+MISSING = ["Not provided", "Not applicable"]
+CONDITIONS = [
+    "alzheimers",
+    "cancer",
+    "cardiovascular_disease",
+    "diabetes",
+    "ibd",
+    "ibs",
+    "kidney_disease",
+    "liver_disease",
+    "lung_disease",
+    "skin_condition",
+]
+CONDITION_VALUES = [
+    NO_CONDITION,
+    DIAGNOSED,
+    "Self-diagnosed",
+    "Diagnosed by an alternative medicine practitioner",
+] + MISSING
+SMOKING = [
+    "Never",
+    "Rarely (a few times/month)",
+    "Daily",
+    "Occasionally (1-2 times/week)",
+    "Regularly (3-5 times/week)",
+] + MISSING
+EDUCATION = [
+    "Bachelor's degree",
+    "Graduate or Professional degree",
+    "High School or GED equivalent",
+] + MISSING
+
+
+def _numbers(rng, n, low, high, decimals):
+    """Draw numbers as text, with some of them missing."""
+    values = np.round(rng.uniform(low, high, n), decimals).astype(str)
+    return np.where(rng.random(n) < 0.1, rng.choice(MISSING, n), values)
+
+
+def sample_ids(n):
+    """Generate sample ids that pandas always reads as text."""
+    return ["10317.%09d.s" % i for i in range(n)]
+
+
+def metadata(seed, n_samples):
+    """Generate a raw metadata table as read from `metadata.tsv`.
+
+    The table is written to and read back from a TSV so the column types
+    are the same as for the real data.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_samples
+    table = pd.DataFrame(
+        {
+            "sample_name": sample_ids(n),
+            "dog": rng.choice(["true", "false"] + MISSING, n),
+            "cat": rng.choice(["true", "false"] + MISSING, n),
+            "sex": rng.choice(["female", "male", "other"] + MISSING, n),
+            "mental_illness": rng.choice(["true", "false"] + MISSING, n),
+            "alcohol_consumption": rng.choice(["true", "false"] + MISSING, n),
+            "smoking_frequency": rng.choice(SMOKING, n),
+            "level_of_education": rng.choice(EDUCATION, n),
+            # Wide enough to hit the filters in both directions
+            "birth_year": _numbers(rng, n, 1920, 2010, 0),
+            "bmi": _numbers(rng, n, 10, 45, 2),
+            "height_cm": _numbers(rng, n, 120, 230, 1),
+        }
+    )
+    for condition in CONDITIONS:
+        table[condition] = rng.choice(
+            CONDITION_VALUES, n, p=[0.6, 0.2, 0.05, 0.05, 0.05, 0.05]
+        )
+    buffer = io.StringIO()
+    table.to_csv(buffer, sep="\t", index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype={"id": str}, sep="\t")
+
+
+def taxonomy(seed, n_genera):
+    """Generate lineages for a set of genera, some unclassified."""
+    rng = np.random.default_rng(seed)
+    taxa = pd.DataFrame(
+        {
+            "Kingdom": "Bacteria",
+            "Phylum": rng.choice(PHYLA, n_genera),
+            "Class": ["c%d" % i for i in rng.integers(0, 5, n_genera)],
+            "Order": ["o%d" % i for i in rng.integers(0, 8, n_genera)],
+            "Family": ["f%d" % i for i in rng.integers(0, 12, n_genera)],
+            "Genus": ["g%d" % i for i in range(n_genera)],
+        }
+    )
+    unclassified = rng.random(n_genera) < 0.1
+    taxa.loc[unclassified, "Genus"] = np.nan
+    return taxa
+
+
+def counts(seed, n_samples, n_genera, sparsity=0.5, max_count=500):
+    """Generate a samples x genera count matrix with many zeros."""
+    rng = np.random.default_rng(seed)
+    values = rng.negative_binomial(1, 1 / max_count, (n_samples, n_genera))
+    values[rng.random(values.shape) < sparsity] = 0
+    return pd.DataFrame(
+        values,
+        index=pd.Index(sample_ids(n_samples), name="id"),
+        columns=["g%d" % i for i in range(n_genera)],
+    )
+
+
+def genus_table(seed, n_samples, n_genera):
+    """Generate the long genus table as in `american_gut_genus.csv`.
+
+    Has one row per sample and observed lineage with the columns `id`,
+    `count` and one column per rank. Like in the real data every sample has
+    at least one read.
+    """
+    wide = counts(seed, n_samples, n_genera)
+    values = wide.values.copy()
+    empty = values.sum(axis=1) == 0
+    values[empty, np.random.default_rng(seed).integers(0, n_genera)] = 1
+    taxa = taxonomy(seed, n_genera)
+    rows, cols = np.nonzero(values)
+    table = taxa.iloc[cols].reset_index(drop=True)
+    table.insert(0, "count", values[rows, cols])
+    table.insert(0, "id", wide.index[rows])
+    return table
+
+
+def phyla(seed, ids):
+    """Generate Bacteroidetes and Firmicutes fractions and PCoA coordinates."""
+    rng = np.random.default_rng(seed)
+    fractions = rng.dirichlet([2, 2, 1], len(ids))[:, :2]
+    return pd.DataFrame(
+        np.hstack([rng.normal(size=(len(ids), 2)), fractions]),
+        index=ids,
+        columns=["PC1", "PC2", "Bacteroidetes", "Firmicutes"],
+    )
+
+
+seeds = st.integers(min_value=0, max_value=2 ** 32 - 1)
@@ -0,0 +1,151 @@
+"""Fail when an optimized code path gets slower than its baseline.
+
+Timings are stored as speedups over the reference implementations in
+`benchmarks.json`, so the baselines do not depend on the machine running the
+tests. After an intended change record new baselines with
+
+    UPDATE_BENCHMARKS=1 python -m pytest tests/test_benchmarks.py
+"""
+
+import json
+import os
+import tempfile
+import timeit
+from os import path
+import matplotlib.pyplot as plt
+import pytest
+
+import reference
+import schema
+from dataset import build_dataset, Dataset
+from helpers import filled_bar
+from metadata import healthiest, typed_metadata
+from neighbours import (
+    closest,
+    describe,
+    describe_neighbourhood,
+    find_closest,
+    metadata_features,
+    neighbourhood,
+)
+from rarefaction import rarefy_counts
+
+BASELINES = path.join(path.dirname(path.abspath(__file__)), "benchmarks.json")
+
+# A benchmark fails if its speedup drops below this fraction of the baseline
+TOLERANCE = 0.5
+
+
+def best_time(fun, repeat):
+    """Get the fastest of several runs in seconds."""
+    return min(timeit.repeat(fun, number=1, repeat=repeat))
+
+
+def rarefaction_case():
+    counts = schema.counts(0, 200, 300)
+    return (
+        lambda: rarefy_counts(counts, 1000, seed=0),
+        lambda: reference.rarefy_counts(counts, 1000),
+    )
+
+
+def find_closest_case():
+    samples = schema.phyla(0, schema.sample_ids(5000))
+    return (
+        lambda: find_closest(0.4, 0.2, samples),
+        lambda: reference.find_closest(0.4, 0.2, samples.copy()),
+    )
+
+
+def describe_case():
+    meta = schema.metadata(0, 5000)
+    typed = typed_metadata(meta)
+    samples = schema.phyla(0, schema.sample_ids(5000)).iloc[:50]
+    return (
+        lambda: describe(samples, typed),
+        lambda: reference.describe(samples, meta.copy()),
+    )
+
+
+def neighbourhood_case():
+    # what the app does when the sliders move, with precomputed features
+    meta = schema.metadata(0, 5000)
+    samples = schema.phyla(0, schema.sample_ids(5000))
+    features = metadata_features(typed_metadata(meta))
+    order = closest(0.4, 0.2, samples, 50)
+    return (
+        lambda: describe_neighbourhood(neighbourhood(order, features), 50),
+        lambda: reference.describe(samples.iloc[order], meta.copy()),
+    )
+
+
+def healthiest_case():
+    meta = schema.metadata(0, 5000)
+    typed = typed_metadata(meta)
+    samples = schema.phyla(0, schema.sample_ids(5000))
+    return (
+        lambda: healthiest(samples, typed),
+        lambda: reference.healthiest(samples, meta.copy()),
+    )
+
+
+def filled_bar_case(directory):
+    table = schema.genus_table(0, 2000, 100)
+    meta = schema.metadata(0, 2000)
+    table.to_csv(path.join(directory, "genera.csv"), index=False)
+    meta.to_csv(path.join(directory, "metadata.tsv"), sep="\t", index=False)
+    build_dataset(
+        path.join(directory, "genera.csv"),
+        path.join(directory, "metadata.tsv"),
+        path.join(directory, "store"),
+    )
+    dataset = Dataset(path.join(directory, "store"))
+
+    def fast():
+        filled_bar(dataset)
+        plt.close("all")
+
+    def ref():
+        reference.filled_bar(table)
+        plt.close("all")
+
+    return fast, ref
+
+
+CASES = {
+    "rarefy_counts": rarefaction_case,
+    "find_closest": find_closest_case,
+    "describe": describe_case,
+    "describe_neighbourhood": neighbourhood_case,
+    "healthiest": healthiest_case,
+    "filled_bar": filled_bar_case,
+}
+
+
+@pytest.fixture(scope="module")
+def baselines():
+    """Load the baselines and save them again when updating."""
+    with open(BASELINES) as handle:
+        speedups = json.load(handle)
+    yield speedups
+    if os.environ.get("UPDATE_BENCHMARKS"):
+        with open(BASELINES, "w") as handle:
+            json.dump(speedups, handle, indent=4, sort_keys=True)
+            handle.write("\n")
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_speedup(name, baselines):
+    with tempfile.TemporaryDirectory() as directory:
+        case = CASES[name]
+        fast, ref = case(directory) if name == "filled_bar" else case()
+        fast()
+        speedup = best_time(ref, 3) / best_time(fast, 5)
+    if os.environ.get("UPDATE_BENCHMARKS"):
+        baselines[name] = round(speedup, 1)
+        return
+    assert name in baselines, "No baseline for `%s`." % name
+    assert speedup >= TOLERANCE * baselines[name], (
+        "`%s` is %.1fx faster than the reference, the baseline is %.1fx."
+        % (name, speedup, baselines[name])
+    )
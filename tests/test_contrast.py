@@ -0,0 +1,55 @@
+"""Check the genus contrasts against scipy."""
+
+import numpy as np
+import pytest
+from scipy.stats import false_discovery_control, mannwhitneyu
+
+import schema
+from contrast import contrast, fdr, genus_ranks
+
+
+@pytest.mark.parametrize("seed, n_samples, k", [(0, 60, 10), (1, 200, 70)])
+def test_contrast(seed, n_samples, k):
+    counts = schema.counts(seed, n_samples, 25)
+    counts = counts[counts.sum(axis=1) > 0]
+    relative = counts.div(counts.sum(axis=1), axis=0)
+    members = np.random.default_rng(seed).choice(
+        relative.shape[0], k, replace=False
+    )
+    ranks, ties = genus_ranks(relative)
+    result = contrast(ranks, ties, members, list(relative.columns))
+    result = result.set_index("genus").loc[relative.columns]
+    rest = np.setdiff1d(np.arange(relative.shape[0]), members)
+    # most genera have many tied zeros
+    assert (ties > 0).all()
+    for genus in relative.columns:
+        values = relative[genus].values
+        if np.unique(values).shape[0] == 1:
+            assert result.loc[genus, "p"] == 1.0
+            continue
+        ref = mannwhitneyu(
+            values[members],
+            values[rest],
+            use_continuity=False,
+            method="asymptotic",
+        )
+        u = result.loc[genus, "auc"] * k * rest.shape[0]
+        np.testing.assert_allclose(u, ref.statistic, rtol=1e-9)
+        np.testing.assert_allclose(result.loc[genus, "p"], ref.pvalue)
+    assert result.q.tolist() == fdr(result.p).tolist()
+
+
+def test_fdr():
+    pvalues = [0.01, 0.04, 0.03, 0.005, 0.2]
+    np.testing.assert_allclose(
+        fdr(pvalues), [0.025, 0.05, 0.05, 0.025, 0.2]
+    )
+    # the example from Benjamini and Hochberg (1995), four hypotheses are
+    # rejected at a false discovery rate of 0.05
+    pvalues = [
+        0.0001, 0.0004, 0.0019, 0.0095, 0.0201, 0.0278, 0.0298, 0.0344,
+        0.0459, 0.3240, 0.4262, 0.5719, 0.6528, 0.7590, 1.0000,
+    ]
+    assert (fdr(pvalues) <= 0.05).sum() == 4
+    pvalues = np.random.default_rng(0).uniform(0, 0.1, 100) ** 2
+    np.testing.assert_allclose(fdr(pvalues), false_discovery_control(pvalues))
@@ -0,0 +1,278 @@
+"""Check the optimized code paths against the reference implementations."""
+
+import tempfile
+from os import path
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from hypothesis import HealthCheck, example, given, settings, strategies as st
+from skbio import DistanceMatrix
+from skbio.diversity import beta_diversity
+from skbio.stats.ordination import pcoa
+
+import reference
+import schema
+from dataset import build_dataset, Dataset
+from helpers import filled_bar
+from metadata import healthiest, typed_metadata
+from neighbours import (
+    SMOKING,
+    closest,
+    describe,
+    describe_neighbourhood,
+    find_closest,
+    metadata_features,
+    neighbour_grid,
+    neighbourhood,
+)
+from ordination import subgroup_ordinations
+from rarefaction import rarefaction_curves, rarefy_counts
+from tiles import create_job, merge, work
+
+slow = settings(
+    max_examples=15,
+    deadline=None,
+    suppress_health_check=[HealthCheck.too_slow],
+)
+
+
+def write_dataset(directory, seed, n_samples, n_genera):
+    """Save a random genus table and metadata and build a dataset."""
+    genera_file = path.join(directory, "genera.csv")
+    metadata_file = path.join(directory, "metadata.tsv")
+    table = schema.genus_table(seed, n_samples, n_genera)
+    table.to_csv(genera_file, index=False)
+    meta = schema.metadata(seed, n_samples)
+    meta.to_csv(metadata_file, sep="\t", index=False)
+    build_dataset(genera_file, metadata_file, path.join(directory, "store"))
+    return table, meta, Dataset(path.join(directory, "store"))
+
+
+def assert_same_description(fast, ref):
+    """Compare descriptions, counts exactly and averages with a tolerance.
+
+    The reference never counts any smokers because it requires all smoking
+    frequencies at once, so smokers are only checked for the fast path.
+    """
+    assert fast.names.tolist() == ref.names.tolist()
+    assert fast.icon.tolist() == ref.icon.tolist()
+    compared = (ref.names != "Smokers").values
+    averages = ref.names.str.startswith("Average").values
+    fast_values = fast["values"].values.astype(float)
+    ref_values = ref["values"].values.astype(float)
+    np.testing.assert_array_equal(
+        fast_values[compared & ~averages], ref_values[compared & ~averages]
+    )
+    np.testing.assert_allclose(
+        fast_values[averages], ref_values[averages], rtol=1e-9
+    )
+
+
+def ordinate(distances):
+    """Get the first two principal coordinates."""
+    return pcoa(distances, number_of_dimensions=2).samples
+
+
+def assert_same_axes(fast, ref, atol=1e-6):
+    """Compare ordination coordinates up to the sign of each axis."""
+    fast, ref = np.asarray(fast), np.asarray(ref)
+    for axis in range(ref.shape[1]):
+        sign = np.sign(np.dot(fast[:, axis], ref[:, axis])) or 1.0
+        np.testing.assert_allclose(
+            sign * fast[:, axis], ref[:, axis], atol=atol
+        )
+
+
+@given(
+    schema.seeds,
+    st.integers(1, 40),
+    st.integers(1, 30),
+    st.sampled_from([1, 10, 100, 1000]),
+)
+@settings(deadline=None)
+def test_rarefy_depth(seed, n_samples, n_genera, depth):
+    counts = schema.counts(seed, n_samples, n_genera)
+    rare = rarefy_counts(counts, depth, seed=seed)
+    ref = reference.rarefy_counts(counts, depth)
+    # the same samples are dropped and every sample has the exact depth
+    assert rare.index.equals(counts.index[counts.sum(axis=1) >= depth])
+    assert list(rare.columns) == list(counts.columns)
+    if ref.shape[0] > 0:
+        assert rare.index.equals(ref.index)
+    assert (rare.sum(axis=1) == depth).all()
+    # reads can only be drawn from what was observed
+    assert (rare.values <= counts.loc[rare.index].values).all()
+    assert (rare.values >= 0).all()
+
+
+@pytest.mark.parametrize(
+    "observed, depth",
+    [([50, 30, 15, 5, 0, 1], 20), ([1000, 1, 1, 1], 500), ([3, 3, 3], 8)],
+)
+def test_rarefy_distribution(observed, depth):
+    draws = 4000
+    counts = pd.DataFrame(np.tile(observed, (draws, 1)))
+    rare = rarefy_counts(counts, depth, seed=42).values
+    ref = reference.rarefy_counts(counts.iloc[:1000], depth).values
+    # each taxon follows a hypergeometric distribution
+    observed = np.array(observed, dtype=float)
+    total = observed.sum()
+    p = observed / total
+    mean = depth * p
+    var = depth * p * (1 - p) * (total - depth) / (total - 1)
+    for sample in (rare, ref):
+        se = np.sqrt(var / sample.shape[0])
+        assert (np.abs(sample.mean(axis=0) - mean) <= 5 * se + 1e-12).all()
+        np.testing.assert_allclose(
+            sample.var(axis=0), var, rtol=0.2, atol=1e-9
+        )
+    # and the expected richness matches the analytic rarefaction curve
+    curve = rarefaction_curves(counts.iloc[:1], [depth]).iloc[0, 0]
+    richness = (ref > 0).sum(axis=1)
+    assert abs(richness.mean() - curve) <= 5 * richness.std() / 30 + 1e-9
+
+
+@given(
+    schema.seeds,
+    st.integers(5, 200),
+    st.floats(0, 1),
+    st.floats(0, 1),
+)
+@settings(deadline=None)
+def test_find_closest(seed, n_samples, bacteroidetes, firmicutes):
+    samples = schema.phyla(seed, schema.sample_ids(n_samples))
+    fast = find_closest(bacteroidetes, firmicutes, samples, 5)
+    ref = reference.find_closest(bacteroidetes, firmicutes, samples.copy())
+    distance = np.hypot(
+        samples.Bacteroidetes - bacteroidetes, samples.Firmicutes - firmicutes
+    )
+    # ids can only differ for individuals at the same distance
+    np.testing.assert_allclose(distance[fast], distance[ref], rtol=1e-12)
+    if np.unique(distance[ref]).shape[0] == len(ref):
+        assert fast == ref
+
+
+@given(schema.seeds, st.integers(5, 60))
+@settings(deadline=None)
+def test_neighbour_grid(seed, n_samples):
+    samples = schema.phyla(seed, schema.sample_ids(n_samples))
+    grid = neighbour_grid(samples, n=5, steps=4)
+    for b in range(5):
+        for f in range(5):
+            ref = reference.find_closest(b / 4, f / 4, samples.copy())
+            fast = samples.index[grid[b, f]].tolist()
+            distance = np.hypot(
+                samples.Bacteroidetes - b / 4, samples.Firmicutes - f / 4
+            )
+            np.testing.assert_allclose(distance[fast], distance[ref])
+
+
+@given(schema.seeds, st.integers(1, 100), st.integers(1, 50))
+@settings(deadline=None)
+def test_describe(seed, n_samples, k):
+    meta = schema.metadata(seed, n_samples)
+    samples = schema.phyla(seed, schema.sample_ids(n_samples)).iloc[:k]
+    ref = reference.describe(samples, meta.copy())
+    fast = describe(samples, typed_metadata(meta))
+    assert_same_description(fast, ref)
+    smokers = meta.set_index("sample_name").loc[samples.index]
+    assert fast.set_index("names").loc["Smokers", "values"] == (
+        smokers.smoking_frequency.isin(SMOKING).sum()
+    )
+
+
+@given(schema.seeds, st.integers(5, 100), st.floats(0, 1), st.floats(0, 1))
+@settings(deadline=None)
+def test_describe_neighbourhood(seed, n_samples, bacteroidetes, firmicutes):
+    meta = schema.metadata(seed, n_samples)
+    samples = schema.phyla(seed, schema.sample_ids(n_samples))
+    features = metadata_features(typed_metadata(meta).loc[samples.index])
+    order = closest(bacteroidetes, firmicutes, samples, n_samples)
+    stats = neighbourhood(order, features)
+    for k in {1, 5, n_samples // 2, n_samples}:
+        ref = reference.describe(samples.iloc[order[:k]], meta.copy())
+        assert_same_description(describe_neighbourhood(stats, k), ref)
+
+
+@given(schema.seeds, st.integers(1, 300))
+@settings(deadline=None)
+def test_healthiest(seed, n_samples):
+    meta = schema.metadata(seed, n_samples)
+    samples = schema.phyla(seed, schema.sample_ids(n_samples))
+    ref = reference.healthiest(samples, meta.copy())
+    fast = healthiest(samples, typed_metadata(meta))
+    np.testing.assert_allclose(fast["mean"].values, ref.values, rtol=1e-12)
+    assert fast.index.tolist() == ref.index.tolist()
+
+
+def area_data(ax):
+    """Get the legend and plotted values of a filled bar chart."""
+    labels = [text.get_text() for text in ax.get_legend().get_texts()]
+    values = np.array([line.get_ydata() for line in ax.get_lines()])
+    plt.close(ax.figure)
+    return labels, values
+
+
+@given(schema.seeds, st.integers(2, 30), st.integers(2, 40))
+@example(1097476, 2, 2)
+@slow
+def test_filled_bar(seed, n_samples, n_genera):
+    with tempfile.TemporaryDirectory() as directory:
+        table, meta, dataset = write_dataset(
+            directory, seed, n_samples, n_genera
+        )
+        ref_labels, ref_values = area_data(reference.filled_bar(table))
+        for fast in (table, dataset):
+            labels, values = area_data(filled_bar(fast))
+            assert labels == ref_labels
+            np.testing.assert_allclose(values, ref_values, rtol=1e-12)
+        # filtered queries match filtering the long table
+        dogs = meta.sample_name[meta.dog == "true"]
+        subset = table[table.id.isin(dogs)]
+        if subset.id.nunique() > 1:
+            ref_labels, ref_values = area_data(reference.filled_bar(subset))
+            labels, values = area_data(filled_bar(dataset.where(dog="true")))
+            assert labels == ref_labels
+            np.testing.assert_allclose(values, ref_values, rtol=1e-12)
+
+
+@given(
+    schema.seeds,
+    st.integers(6, 40),
+    st.integers(2, 30),
+    st.integers(2, 15),
+)
+@slow
+def test_ordinations(seed, n_samples, n_genera, tile_size):
+    with tempfile.TemporaryDirectory() as directory:
+        _, meta, dataset = write_dataset(directory, seed, n_samples, n_genera)
+        counts = schema.counts(seed, n_samples, n_genera)
+        counts = counts[counts.sum(axis=1) > 0]
+        ids = counts.index.values
+        ref = beta_diversity("braycurtis", counts.values, ids)
+
+        # tiled distances
+        job = path.join(directory, "job")
+        create_job(job, counts.values, ids, tile_size=tile_size)
+        work(job, poll=0)
+        prefix = path.join(directory, "distances")
+        merge(job, prefix)
+        distances = np.load(prefix + ".npy")
+        np.testing.assert_allclose(distances, ref.data, atol=1e-12)
+
+        # full ordination
+        full = ordinate(DistanceMatrix(distances, ids))
+        assert_same_axes(full, ordinate(ref))
+
+        # subgroup ordinations from slices of the stored distances
+        dogs = ids[np.isin(ids, meta.sample_name[meta.dog == "true"])]
+        subgroups = subgroup_ordinations(
+            distances, ids, dataset, {"Dog owners": {"dog": "true"}}
+        )
+        if dogs.shape[0] < 3:
+            assert subgroups.shape[0] == 0
+            return
+        sub = beta_diversity("braycurtis", counts.loc[dogs].values, dogs)
+        assert subgroups.index.tolist() == dogs.tolist()
+        assert_same_axes(subgroups[["PC1", "PC2"]], ordinate(sub))
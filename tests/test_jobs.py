@@ -0,0 +1,146 @@
+"""Tests for the job queue used by the cohort search."""
+
+import os
+import pickle
+import time
+import pytest
+
+from jobs import JobQueue, QueueFull
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def echo(value):
+    return value, os.getpid()
+
+
+def fail():
+    raise ValueError("failed on purpose")
+
+
+def wait(queue, key, timeout=10):
+    """Poll a job until it is no longer pending."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state, result = queue.status(key)
+        if state != "pending":
+            return state, result
+        time.sleep(0.02)
+    raise AssertionError("Job %s did not finish." % key)
+
+
+@pytest.fixture
+def queue():
+    jobs = JobQueue(workers=1, max_pending=2, timeout=0.3)
+    yield jobs
+    jobs.shutdown()
+
+
+def test_result(queue):
+    key = queue.submit(sleep, 0.01)
+    assert wait(queue, key) == ("done", 0.01)
+    assert queue.status("nope") == ("unknown", None)
+
+
+def test_failure(queue):
+    assert wait(queue, queue.submit(fail)) == ("failed", None)
+
+
+def test_dedup(queue):
+    first = queue.submit(sleep, 0.1)
+    assert queue.submit(sleep, 0.1) == first
+    assert len(queue.jobs) == 1 and queue.pending() == 1
+    wait(queue, first)
+    # finished jobs are not run again either
+    assert queue.submit(sleep, 0.1) == first
+    assert queue.pending() == 0
+
+
+def test_queue_full(queue):
+    queue.submit(sleep, 0.2)
+    queue.submit(sleep, 0.21)
+    with pytest.raises(QueueFull):
+        queue.submit(sleep, 0.22)
+
+
+def test_timeout(queue):
+    key = queue.submit(sleep, 1.0)
+    time.sleep(0.4)
+    assert queue.status(key) == ("timeout", None)
+    # the timed out job is still running and keeps its slot when the same
+    # work is submitted again
+    assert queue.submit(sleep, 1.0) == key
+    assert queue.pending() == 2
+    with pytest.raises(QueueFull):
+        queue.submit(sleep, 0.5)
+    for _ in range(3):
+        time.sleep(0.35)
+        try:
+            queue.submit(sleep, 1.0)
+        except QueueFull:
+            pass
+        assert queue.pending() <= queue.max_pending
+
+
+def test_shared_directory(tmp_path):
+    # two server processes sharing a directory
+    first = JobQueue(workers=1, timeout=5, directory=str(tmp_path))
+    second = JobQueue(workers=1, timeout=5, directory=str(tmp_path))
+    try:
+        key = first.submit(sleep, 0.3)
+        assert second.status(key) == ("pending", None)
+        # the second process does not run the same job again
+        assert second.submit(sleep, 0.3) == key
+        assert second.pending() == 0
+        assert wait(second, key) == ("done", 0.3)
+        failed = first.submit(fail)
+        wait(first, failed)
+        assert second.status(failed) == ("failed", None)
+    finally:
+        first.shutdown()
+        second.shutdown()
+
+
+def test_fork():
+    # a queue created before forking the server workers
+    jobs = JobQueue(workers=1, timeout=5)
+    try:
+        key = jobs.submit(echo, "parent")
+        assert wait(jobs, key)[1][0] == "parent"
+        children = []
+        for i in range(3):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.close(read)
+                    results = [
+                        wait(jobs, jobs.submit(echo, "w%d-%d" % (i, j)))
+                        for j in range(3)
+                    ]
+                    pending = jobs.pending()
+                    # the pool processes inherited the pipe, stop them so
+                    # the parent sees its end
+                    jobs.executor.shutdown(wait=True)
+                    with os.fdopen(write, "wb") as handle:
+                        pickle.dump((results, pending), handle)
+                finally:
+                    os._exit(0)
+            os.close(write)
+            children.append((i, pid, read))
+        for i, pid, read in children:
+            with os.fdopen(read, "rb") as handle:
+                results, pending = pickle.load(handle)
+            os.waitpid(pid, 0)
+            # every process only gets the results of its own jobs
+            assert [(state, value[0]) for state, value in results] == [
+                ("done", "w%d-%d" % (i, j)) for j in range(3)
+            ]
+            assert pending == 0
+        # and the parent can still use its own pool
+        assert wait(jobs, jobs.submit(echo, "again"))[1][0] == "again"
+    finally:
+        jobs.shutdown()
@@ -0,0 +1,23 @@
+"""Tests for the percentile lookups shown next to the sliders."""
+
+import numpy as np
+import pandas as pd
+
+from percentiles import percentile, percentile_index
+
+
+def test_ties():
+    cohort = pd.DataFrame(
+        {
+            "Bacteroidetes": [0.1, 0.2, 0.2, 0.5],
+            "Firmicutes": [0.0, 0.0, 0.3, 0.4],
+        }
+    )
+    index = percentile_index(cohort)
+    assert percentile(index, "Bacteroidetes", 0.2) == 25.0
+    assert percentile(index, "Bacteroidetes", 0.6) == 100.0
+    # nobody has less than no Firmicutes
+    assert percentile(index, "Firmicutes", 0.0) == 0.0
+    # two individuals without Firmicutes have an infinite ratio
+    assert percentile(index, "ratio", np.inf) == 50.0
+    assert np.isnan(percentile({"empty": np.array([])}, "empty", 1.0))
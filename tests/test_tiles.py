@@ -0,0 +1,69 @@
+"""Tests for the tiled distance jobs run by several processes."""
+
+import json
+import os
+import time
+from os import path
+import numpy as np
+import pytest
+from skbio.diversity import beta_diversity
+
+import schema
+from tiles import claim, create_job, merge, progress, run_local
+
+
+@pytest.fixture
+def counts():
+    counts = schema.counts(0, 40, 12)
+    return counts[counts.sum(axis=1) > 0]
+
+
+def test_run_local(tmp_path, counts):
+    job = str(tmp_path / "job")
+    create_job(job, counts.values, counts.index, tile_size=6)
+    run_local(job, workers=3)
+    done, failed, total = progress(job)
+    assert total > 3 and done == total and failed == 0
+    prefix = str(tmp_path / "distances")
+    merge(job, prefix)
+    ref = beta_diversity("braycurtis", counts.values, counts.index)
+    np.testing.assert_allclose(np.load(prefix + ".npy"), ref.data, atol=1e-12)
+    ids = np.load(prefix + "_ids.npy").astype(str)
+    assert ids.tolist() == counts.index.tolist()
+    # every tile was claimed and released again
+    assert os.listdir(path.join(job, "locks")) == []
+
+
+def test_failed_tile(tmp_path, counts):
+    job = str(tmp_path / "job")
+    create_job(job, counts.values, counts.index, tile_size=20)
+    # break a single tile so computing it raises in the workers
+    filename = path.join(job, "manifest.json")
+    with open(filename) as handle:
+        manifest = json.load(handle)
+    manifest["tiles"][1] = ["a", "b", "c", "d"]
+    with open(filename, "w") as handle:
+        json.dump(manifest, handle)
+    with pytest.raises(RuntimeError, match="Only 2 of 3 tiles finished"):
+        run_local(job, workers=2, max_retries=2)
+    # the tile was tried exactly `max_retries` times and then given up
+    with open(path.join(job, "failed", "tile_1.log")) as handle:
+        assert len(handle.readlines()) == 2
+    assert progress(job, max_retries=2) == (2, 1, 3)
+    with pytest.raises(ValueError, match="1 tiles are not finished"):
+        merge(job, str(tmp_path / "distances"))
+
+
+def test_claim(tmp_path, counts):
+    job = str(tmp_path / "job")
+    create_job(job, counts.values, counts.index, tile_size=20)
+    assert claim(job, 0)
+    # only one worker can hold a tile
+    assert not claim(job, 0)
+    assert claim(job, 1)
+    # locks of workers that died are taken over once the lease is over
+    lock = path.join(job, "locks", "tile_0.lock")
+    os.utime(lock, (time.time() - 120, time.time() - 120))
+    assert not claim(job, 0, lease=600)
+    assert claim(job, 0, lease=60)
+    assert time.time() - os.stat(lock).st_mtime < 60